@@ -0,0 +1,53 @@
+"""
+Parser benchmark on the corpus of rly outputs in tests/corpus.
+
+Each parser is timed on the samples and on large synthetic outputs. The
+format checks and the fuzzing of the corpus are tests, in
+tests/test_parsers.py.
+
+    python benchmarks/parsing.py
+    python benchmarks/parsing.py --repeat 2000
+"""
+import argparse
+import os
+import sys
+import timeit
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, REPO_DIR)
+from tests.test_parsers import load_corpus, sample_parser  # noqa: E402
+
+
+def synthetic_samples() -> dict:
+    """Outputs far larger than the corpus: many denoms, a long backlog and many clients."""
+    coins = ",".join(f"{index * 7919}transfer/channel-{index}/uatom" for index in range(1000))
+    sequences = ",".join(str(sequence) for sequence in range(100000, 110000) if sequence % 97)
+    clients = "\n".join(f"client 07-tendermint-{index} (chain-{index}) expires in {index % 20}d3h (05 Nov 26 14:32 UTC)"
+                        for index in range(500))
+    return {
+        "balance (1000 denoms)": f"address {{cosmos1qy352eufqy352eufqy352eufqy352euf6kx4ey}} balance {{{coins}}}",
+        "unrelayed-packets (10k pending)": f'{{"src":[{sequences}],"dst":null}}',
+        "clients-expiration (500 clients)": clients,
+    }
+
+
+def benchmark(samples: dict, repeat: int):
+    print(f"{'sample':<36} {'size':>9} {'per call':>10}")
+    for name, output in samples.items():
+        parse = sample_parser(name)
+        seconds = min(timeit.repeat(lambda: parse(output), number=repeat, repeat=3)) / repeat
+        print(f"{name:<36} {len(output):>8}B {seconds * 1e6:>8.1f}us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the rly output parsers")
+    parser.add_argument("--repeat", type=int, default=500,
+                        help="Calls per timing of each sample")
+    args = parser.parse_args()
+
+    benchmark({**load_corpus(), **synthetic_samples()}, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Scale benchmarks for app.py against stand-in kubectl and rly executables.
+
+Each scenario builds a synthetic CONFIG["paths"] of the requested size,
+spread over several categories, and runs one app.py check mode end to end in
+a fresh interpreter with bin/ first on the PATH. The stand-ins count their
+invocations and sleep for a configurable delay to mimic pod and chain RPC
+latency, so no cluster is needed.
+
+    python benchmarks/run.py
+    python benchmarks/run.py --sizes 10 100 --modes all --rly-delay 0.2 -- --batch
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+CHAINS = ["akash", "osmosis", "axelar", "neutron", "kava", "regen", "noble", "crescent"]
+
+
+def synthetic_config(size: int, categories: int) -> dict:
+    """
+    Build the paths, namespaces and relayers for a synthetic deployment.
+
+    Args:
+        size (int): The total number of paths.
+        categories (int): The number of categories the paths are spread over.
+
+    Returns:
+        dict: The contents of the config file.
+    """
+    config = {"paths": {}, "namespaces": {}, "relayers": {}, "relayer_concurrency": {}}
+    for index in range(categories):
+        category = f"customer{index}"
+        config["paths"][category] = {}
+        config["namespaces"][category] = f"customer-{category}"
+        config["relayers"][category] = "relayer--mainnet"
+        config["relayer_concurrency"][category] = 4
+    for index in range(size):
+        category = f"customer{index % categories}"
+        chain_name = f"{CHAINS[index % len(CHAINS)]}{index}"
+        config["paths"][category][f"mainnet-{category}-{chain_name}"] = {
+            "chain_name": chain_name,
+            "channel": f"channel-{index}",
+            "tokens": {
+                f"u{chain_name}": {
+                    "alerts": {
+                        "low_balance_warn_threshold": 5000000,
+                        "low_balance_error_threshold": 1000000,
+                    }
+                },
+                "transfer/channel-4/uusdc": {
+                    "alerts": {
+                        "low_balance_warn_threshold": 2500000,
+                        "low_balance_error_threshold": 500000,
+                    }
+                }
+            }
+        }
+    return config
+
+
+def run_child(config_file: str, app_args: list):
+    """Run app.main in this interpreter and print the measurements as JSON."""
+    sys.path.insert(0, REPO_DIR)
+    import app
+
+    sys.stdout = open(os.devnull, "w")
+    started = time.perf_counter()
+    app.main(["--config", config_file, *app_args])
+    wall = time.perf_counter() - started
+    sys.stdout = sys.__stdout__
+    # ru_maxrss is in kilobytes on Linux
+    print(json.dumps({"wall": wall, "rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+
+
+def count(count_dir: str, name: str) -> int:
+    try:
+        with open(os.path.join(count_dir, name)) as f:
+            return sum(1 for _ in f)
+    except FileNotFoundError:
+        return 0
+
+
+def run_scenario(size: int, mode: str, args) -> dict:
+    """
+    Run one check mode against a synthetic deployment in a fresh interpreter.
+
+    Args:
+        size (int): The number of paths.
+        mode (str): The check mode, e.g. "balance".
+        args (argparse.Namespace): The benchmark arguments.
+
+    Returns:
+        dict: The wall time, peak RSS and subprocess counts of the run.
+    """
+    config = synthetic_config(size, args.categories)
+    with tempfile.TemporaryDirectory() as tmp:
+        config_file = os.path.join(tmp, "config.json")
+        with open(config_file, "w") as f:
+            json.dump(config, f)
+        paths_file = os.path.join(tmp, "paths.txt")
+        with open(paths_file, "w") as f:
+            f.writelines(f"{path}\n" for paths in config["paths"].values() for path in paths)
+
+        env = dict(os.environ,
+                   PATH=os.path.join(BENCHMARKS_DIR, "bin") + os.pathsep + os.environ["PATH"],
+                   BENCH_COUNT_DIR=tmp,
+                   BENCH_PATHS_FILE=paths_file,
+                   BENCH_RLY_DELAY=str(args.rly_delay),
+                   BENCH_KUBECTL_DELAY=str(args.kubectl_delay))
+        result = subprocess.run(
+            [sys.executable, __file__, "--child", config_file, "--", f"--{mode}", *args.app_args],
+            env=env, capture_output=True, text=True, check=True)
+        measurements = json.loads(result.stdout.strip().splitlines()[-1])
+        measurements["kubectl"] = count(tmp, "kubectl")
+        measurements["rly"] = count(tmp, "rly")
+    return measurements
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark app.py against stand-in kubectl and rly")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000],
+                        help="Numbers of paths to benchmark")
+    parser.add_argument("--modes", nargs="+", default=["balance", "unrelayed", "all"],
+                        choices=["balance", "unrelayed", "expiration", "all"],
+                        help="Check modes to benchmark")
+    parser.add_argument("--categories", type=int, default=4,
+                        help="Number of categories the paths are spread over")
+    parser.add_argument("--rly-delay", type=float, default=0.05,
+                        help="Seconds each stand-in rly call takes")
+    parser.add_argument("--kubectl-delay", type=float, default=0.05,
+                        help="Seconds each stand-in kubectl exec takes")
+    parser.add_argument("--output", help="Also write the results as JSON to this file")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("app_args", nargs="*", help="Extra arguments passed to app.py, after --")
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.app_args)
+        return
+
+    results = []
+    print(f"{'paths':>6} {'mode':<11} {'wall':>9} {'peak rss':>10} {'kubectl':>8} {'rly':>6}")
+    for size in args.sizes:
+        for mode in args.modes:
+            result = dict(paths=size, mode=mode, **run_scenario(size, mode, args))
+            results.append(result)
+            print(f"{size:>6} {mode:<11} {result['wall']:>8.2f}s {result['rss'] / 1024:>8.1f}MB "
+                  f"{result['kubectl']:>8} {result['rly']:>6}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Startup benchmark for the ibc_monitor package.
+
+Measures, in fresh interpreters, how long importing the package, loading the
+config file and running the first balance check take, using the stand-in rly
+in bin/ without delays. Exits with an error when the median time from import
+to the first reported check exceeds the budget, or when importing the package
+started any subprocess.
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --runs 20 --budget-ms 200
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+
+CONFIG = {
+    "paths": {
+        "kujira": {
+            "mainnet-kujira-akash": {"chain_name": "akash", "channel": "channel-64", "tokens": {}},
+        }
+    },
+    "namespaces": {"kujira": "customer-kujira"},
+    "relayers": {"kujira": "relayer--mainnet"},
+}
+
+
+def run_child(config_file: str, count_dir: str):
+    """Time the startup stages in this interpreter and print them as JSON."""
+    sys.path.insert(0, REPO_DIR)
+    started = time.perf_counter()
+    import ibc_monitor
+    from ibc_monitor import BalanceChecker, CheckExecutor, ConfigFile, use_config
+    imported = time.perf_counter()
+    spawned_at_import = os.path.exists(os.path.join(count_dir, "rly"))
+
+    use_config(ConfigFile(config_file).load())
+    configured = time.perf_counter()
+
+    reported = []
+    check = BalanceChecker().checks()[0]
+    check = check._replace(report=lambda output: reported.append(time.perf_counter()))
+    CheckExecutor.from_config().run([check])
+    print(json.dumps({
+        "package": ibc_monitor.__name__,
+        "import": imported - started,
+        "config": configured - imported,
+        "first_check": reported[0] - started,
+        "spawned_at_import": spawned_at_import,
+    }))
+
+
+def run_once() -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        config_file = os.path.join(tmp, "config.json")
+        with open(config_file, "w") as f:
+            json.dump(CONFIG, f)
+        env = dict(os.environ,
+                   PATH=os.path.join(BENCHMARKS_DIR, "bin") + os.pathsep + os.environ["PATH"],
+                   BENCH_COUNT_DIR=tmp,
+                   BENCH_RLY_DELAY="0",
+                   BENCH_KUBECTL_DELAY="0")
+        result = subprocess.run([sys.executable, __file__, "--child", config_file, tmp],
+                                env=env, capture_output=True, text=True, check=True)
+        return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the startup of the ibc_monitor package")
+    parser.add_argument("--runs", type=int, default=10,
+                        help="Number of fresh interpreters to measure")
+    parser.add_argument("--budget-ms", type=float, default=300,
+                        help="Maximum median time from import to the first reported check")
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(*args.child)
+        return
+
+    # The first run also compiles the bytecode, so it is not measured
+    run_once()
+    runs = [run_once() for _ in range(args.runs)]
+    print(f"{'stage':<12} {'median':>9} {'max':>9}")
+    for stage in ("import", "config", "first_check"):
+        values = [run[stage] * 1000 for run in runs]
+        print(f"{stage:<12} {statistics.median(values):>7.1f}ms {max(values):>7.1f}ms")
+
+    failures = []
+    if any(run["spawned_at_import"] for run in runs):
+        failures.append("importing the package started a subprocess")
+    first_check = statistics.median(run["first_check"] for run in runs) * 1000
+    if first_check > args.budget_ms:
+        failures.append(f"import to first check took {first_check:.1f}ms, over the {args.budget_ms:.0f}ms budget")
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
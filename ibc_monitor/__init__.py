@@ -0,0 +1,36 @@
+"""
+Monitoring of IBC relayers: wallet balances, unrelayed packets and client expirations.
+
+Importing the package has no side effects. Its modules are only imported
+when one of the names below is first used:
+
+    from ibc_monitor import BalanceChecker, ConfigFile, use_config
+
+    use_config(ConfigFile("config.yaml").load())
+    BalanceChecker().run()
+"""
+import importlib
+
+_EXPORTS = {
+    "Checker": "checks",
+    "BalanceChecker": "checks",
+    "ExpirationChecker": "checks",
+    "UnrelayedChecker": "checks",
+    "evaluation_cycle": "checks",
+    "CheckExecutor": "queries",
+    "ConfigError": "settings",
+    "ConfigFile": "settings",
+    "validate_config": "settings",
+    "use_config": "runtime",
+    "main": "cli",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{_EXPORTS[name]}", __name__), name)
+    globals()[name] = value
+    return value
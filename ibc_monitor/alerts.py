@@ -0,0 +1,244 @@
+"""Delivery of warnings and errors to webhook, Slack and PagerDuty sinks."""
+import logging
+import queue
+import threading
+import time
+import urllib.parse
+from typing import NamedTuple
+
+from . import settings
+from .lcd import HTTPConnectionPool
+from .settings import LogLevel
+
+
+class Alert(NamedTuple):
+    """A warning or error raised by a check."""
+    level: int
+    chain: str
+    subject: str
+    message: str
+    timestamp: float
+    # The category whose relayer the alert is about, for alerts on a wallet
+    category: str = ""
+
+    @property
+    def severity(self) -> str:
+        return "error" if self.level >= logging.ERROR else "warning"
+
+    @property
+    def key(self) -> tuple:
+        return (self.category, self.chain, self.subject, self.severity)
+
+
+class AlertSink:
+    """
+    Deliver batches of alerts to one receiver from a background thread.
+
+    Alerts wait in a bounded queue and are sent as one batch whenever the
+    dispatcher flushes, typically at the end of a run. Sending is limited to
+    rate_limit requests per minute; a batch that is held back by the limit,
+    or that could not be delivered, is merged into the next one, keeping the
+    latest alert of each key. A full queue drops alerts rather than blocking
+    the checks. on_delivered, when set, is called with each delivered batch.
+    """
+
+    def __init__(self, url: str, rate_limit: float, queue_size: int, timeout: float, min_level: int = logging.WARNING):
+        self.url = url
+        self.rate_limit = rate_limit
+        self.timeout = timeout
+        self.min_level = min_level
+        self.dropped = 0
+        self.on_delivered = None
+        self._queue = queue.Queue(maxsize=queue_size)
+        # The alerts waiting for the next batch, by key, oldest first
+        self._pending = {}
+        self._max_pending = queue_size
+        self._tokens = rate_limit
+        self._refilled = time.monotonic()
+        endpoint = urllib.parse.urlsplit(url)
+        self._path = urllib.parse.urlunsplit(("", "", endpoint.path or "/", endpoint.query, ""))
+        self._pool = HTTPConnectionPool(endpoint.scheme, endpoint.netloc, timeout, 1)
+        self._thread = threading.Thread(target=self._work, name=f"alerts-{endpoint.netloc}", daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        """Queue an alert, or the FLUSH or STOP marker, without blocking."""
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def _take_token(self) -> bool:
+        now = time.monotonic()
+        self._tokens = min(self.rate_limit, self._tokens + (now - self._refilled) * self.rate_limit / 60)
+        self._refilled = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def _hold(self, alert: Alert):
+        self._pending.pop(alert.key, None)
+        self._pending[alert.key] = alert
+        if len(self._pending) > self._max_pending:
+            del self._pending[next(iter(self._pending))]
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if isinstance(item, Alert):
+                if item.level >= self.min_level:
+                    self._hold(item)
+                continue
+            if self._pending and self._take_token():
+                batch, self._pending = list(self._pending.values()), {}
+                try:
+                    self.send(batch)
+                except OSError as e:
+                    logging.warning(f"Could not deliver {len(batch)} alerts to {self.url}, "
+                                    f"keeping them for the next flush: {e}")
+                    self._pending = {**{alert.key: alert for alert in batch}, **self._pending}
+                else:
+                    if self.on_delivered is not None:
+                        self.on_delivered(batch)
+            if item is AlertDispatcher.STOP:
+                return
+
+    def send(self, batch: list):
+        """Deliver a batch of alerts."""
+        self._pool.request("POST", self._path, {"alerts": [
+            {"severity": alert.severity, "category": alert.category, "chain": alert.chain,
+             "subject": alert.subject, "message": alert.message, "timestamp": alert.timestamp}
+            for alert in batch]})
+
+    def join(self, timeout: float):
+        self._thread.join(timeout)
+
+
+class SlackSink(AlertSink):
+    """Deliver alerts to a Slack incoming webhook, one message per batch."""
+
+    def send(self, batch: list):
+        lines = [f"{':red_circle:' if alert.severity == 'error' else ':warning:'} {alert.message}" for alert in batch]
+        self._pool.request("POST", self._path, {"text": "\n".join(lines)})
+
+
+class PagerDutySink(AlertSink):
+    """Trigger a PagerDuty Events API v2 event per alert, deduplicated by its key."""
+
+    def __init__(self, url: str, rate_limit: float, queue_size: int, timeout: float, min_level: int, routing_key: str):
+        super().__init__(url, rate_limit, queue_size, timeout, min_level)
+        self.routing_key = routing_key
+
+    def send(self, batch: list):
+        for alert in batch:
+            self._pool.request("POST", self._path, {
+                "routing_key": self.routing_key,
+                "event_action": "trigger",
+                "dedup_key": "/".join(part for part in alert.key if part),
+                "payload": {"summary": alert.message, "source": alert.chain, "severity": alert.severity},
+            })
+
+
+ALERT_SINK_TYPES = {"webhook": AlertSink, "slack": SlackSink, "pagerduty": PagerDutySink}
+
+
+class AlertDispatcher:
+    """
+    Hand alerts raised by the checks to the configured sinks without blocking.
+
+    An alert with the same (chain, subject, severity) as one delivered less
+    than repeat_interval seconds ago is dropped, so a low balance is not sent
+    again on every cycle while a change of severity still is. An alert counts
+    as delivered once a sink has sent it.
+    """
+    FLUSH = object()
+    STOP = object()
+
+    def __init__(self, repeat_interval: float):
+        self.repeat_interval = repeat_interval
+        self.sinks = []
+        self._sent = {}
+        self._lock = threading.Lock()
+
+    def configure(self, sinks: list, repeat_interval: float):
+        """Replace the sinks, letting the old ones deliver what they hold."""
+        for sink in sinks:
+            sink.on_delivered = self.delivered
+        with self._lock:
+            old, self.sinks = self.sinks, sinks
+            self.repeat_interval = repeat_interval
+        for sink in old:
+            sink.submit(AlertDispatcher.STOP)
+
+    def submit(self, alert: Alert):
+        """Queue an alert for every sink unless it was sent recently."""
+        with self._lock:
+            if not self.sinks:
+                return
+            last = self._sent.get(alert.key)
+            if last is not None and alert.timestamp - last < self.repeat_interval:
+                return
+            sinks = list(self.sinks)
+        for sink in sinks:
+            sink.submit(alert)
+
+    def delivered(self, batch: list):
+        """Start the repeat interval of each alert in a batch a sink has sent."""
+        with self._lock:
+            for alert in batch:
+                self._sent[alert.key] = max(alert.timestamp, self._sent.get(alert.key, alert.timestamp))
+
+    def flush(self):
+        """Ask every sink to send the alerts of the run as one batch."""
+        for sink in list(self.sinks):
+            sink.submit(AlertDispatcher.FLUSH)
+
+    def close(self, timeout: float):
+        """Send the remaining alerts and wait up to timeout seconds for the sinks."""
+        with self._lock:
+            sinks, self.sinks = self.sinks, []
+        deadline = time.monotonic() + timeout
+        for sink in sinks:
+            sink.submit(AlertDispatcher.STOP)
+        for sink in sinks:
+            sink.join(max(0.0, deadline - time.monotonic()))
+
+
+def create_alert_sinks(config: dict) -> list:
+    """
+    Create the alert sinks described by settings.CONFIG["alert_sinks"].
+
+    Args:
+        config (dict): The complete configuration.
+
+    Returns:
+        list: The sinks, each running its own delivery thread.
+    """
+    sinks = []
+    for sink in config["alert_sinks"]:
+        arguments = (sink["url"], sink.get("rate_limit_per_minute", 6), config["alert_queue_size"],
+                     config["alert_timeout"], LogLevel[sink.get("min_level", "WARNING").upper()].value)
+        if sink["type"] == "pagerduty":
+            sinks.append(PagerDutySink(*arguments, sink["routing_key"]))
+        else:
+            sinks.append(ALERT_SINK_TYPES[sink["type"]](*arguments))
+    return sinks
+
+
+ALERTS = AlertDispatcher(settings.CONFIG["alert_repeat_interval"])
+
+
+def raise_alert(level: int, chain: str, subject: str, message: str, category: str = ""):
+    """
+    Log a warning or error and hand it to the alert sinks.
+
+    Args:
+        level (int): logging.WARNING or logging.ERROR.
+        chain (str): The chain the alert is about.
+        subject (str): What on the chain the alert is about, e.g. a denom or client.
+        message (str): The alert message.
+        category (str): The category whose wallet the alert is about, if any.
+    """
+    logging.log(level, message)
+    ALERTS.submit(Alert(level, chain, subject, message, time.time(), category))
@@ -0,0 +1,210 @@
+"""Recording the outputs of subprocess commands to a cassette file, and replaying them."""
+import hashlib
+import mmap
+import struct
+import threading
+import time
+import zlib
+
+MAGIC = b"IBCCASS1"
+# Key length, payload length, seconds since the recording started, duration, failed
+RECORD = struct.Struct("<IIddB")
+# Key hash, record offset
+INDEX_ENTRY = struct.Struct("<QQ")
+# Index offset, number of index entries, magic
+FOOTER = struct.Struct("<QQ8s")
+
+
+class CassetteError(OSError):
+    """Raised when a cassette file cannot be read."""
+
+
+def key_hash(key: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+
+
+class Cassette:
+    """
+    Outputs of subprocess commands recorded to a file, or served from one.
+
+    While recording, the output or failure of each command is appended with
+    its compressed output as soon as the command finishes, along with when
+    it started and how long it took. Closing the cassette writes an index of
+    the records sorted by a hash of their command. A replayed cassette is
+    memory-mapped and looked up by binary search in that index, so a run
+    only reads and decompresses the records it asks for. A command recorded
+    more than once is answered with its recordings in order, and the last
+    one repeats.
+
+    A cassette whose recording was interrupted has no index. It is indexed
+    by scanning its records when it is replayed.
+    """
+
+    def __init__(self):
+        self.mode = None
+        self.path = None
+        self._file = None
+        self._map = None
+        self._index = []
+        self._index_offset = 0
+        self._index_count = 0
+        self._started = None
+        self._plays = {}
+        self._lock = threading.Lock()
+
+    def start_recording(self, path: str):
+        """Record every command from now on to a new cassette file, replacing any existing one."""
+        self.close()
+        self._file = open(path, "wb")
+        self._file.write(MAGIC)
+        self._index = []
+        self._started = time.monotonic()
+        self.path = path
+        self.mode = "record"
+
+    def start_replay(self, path: str):
+        """
+        Serve commands from a cassette file instead of running them.
+
+        Raises:
+            CassetteError: The file is missing or is not a cassette.
+        """
+        self.close()
+        try:
+            with open(path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            raise CassetteError(f"Could not open cassette {path}: {e}")
+        if self._map[:len(MAGIC)] != MAGIC:
+            self._map.close()
+            self._map = None
+            raise CassetteError(f"{path} is not a cassette")
+        self._index = None
+        self._index_offset, self._index_count = self._read_footer()
+        if self._index_offset is None:
+            self._index = self._scan()
+        self._plays = {}
+        self.path = path
+        self.mode = "replay"
+
+    def _read_footer(self) -> tuple:
+        if len(self._map) < len(MAGIC) + FOOTER.size:
+            return None, 0
+        index_offset, count, magic = FOOTER.unpack_from(self._map, len(self._map) - FOOTER.size)
+        if magic != MAGIC or index_offset + count * INDEX_ENTRY.size != len(self._map) - FOOTER.size:
+            return None, 0
+        return index_offset, count
+
+    def _scan(self) -> list:
+        index = []
+        offset = len(MAGIC)
+        while offset + RECORD.size <= len(self._map):
+            key_length, payload_length, _, _, _ = RECORD.unpack_from(self._map, offset)
+            end = offset + RECORD.size + key_length + payload_length
+            if end > len(self._map):
+                # Cut off in the middle of a record
+                break
+            key = self._map[offset + RECORD.size:offset + RECORD.size + key_length]
+            index.append((key_hash(key), offset))
+            offset = end
+        index.sort()
+        return index
+
+    def add(self, key: str, output: str, started: float, duration: float, failed: bool = False):
+        """
+        Append the result of a command to the cassette being recorded.
+
+        Args:
+            key (str): The command.
+            output (str): Its output, or the reason it failed.
+            started (float): The time.monotonic() at which it started.
+            duration (float): The seconds it took.
+            failed (bool): Whether the command failed.
+        """
+        key = key.encode()
+        payload = zlib.compress(output.encode())
+        with self._lock:
+            if self.mode != "record":
+                return
+            offset = self._file.tell()
+            self._file.write(RECORD.pack(len(key), len(payload), started - self._started, duration, failed))
+            self._file.write(key)
+            self._file.write(payload)
+            self._file.flush()
+            self._index.append((key_hash(key), offset))
+
+    def _entry(self, position: int) -> tuple:
+        if self._index is not None:
+            return self._index[position]
+        return INDEX_ENTRY.unpack_from(self._map, self._index_offset + position * INDEX_ENTRY.size)
+
+    def _offsets(self, digest: int) -> list:
+        count = self._index_count if self._index is None else len(self._index)
+        position = _bisect(lambda position: self._entry(position)[0], count, digest)
+        offsets = []
+        while position < count:
+            entry_hash, offset = self._entry(position)
+            if entry_hash != digest:
+                break
+            offsets.append(offset)
+            position += 1
+        return offsets
+
+    def play(self, key: str) -> tuple:
+        """
+        Look up the next recorded result of a command.
+
+        Args:
+            key (str): The command.
+
+        Returns:
+            tuple: The output, or the reason it failed, and whether it failed.
+
+        Raises:
+            KeyError: The command was never recorded.
+        """
+        key = key.encode()
+        offsets = []
+        for offset in self._offsets(key_hash(key)):
+            key_length, _, _, _, _ = RECORD.unpack_from(self._map, offset)
+            if self._map[offset + RECORD.size:offset + RECORD.size + key_length] == key:
+                offsets.append(offset)
+        if not offsets:
+            raise KeyError(key.decode())
+        with self._lock:
+            played = self._plays.get(key, 0)
+            self._plays[key] = played + 1
+        offset = offsets[min(played, len(offsets) - 1)]
+        key_length, payload_length, _, _, failed = RECORD.unpack_from(self._map, offset)
+        start = offset + RECORD.size + key_length
+        return zlib.decompress(self._map[start:start + payload_length]).decode(), bool(failed)
+
+    def close(self):
+        """Write the index of a recording, or release a replayed file."""
+        with self._lock:
+            if self.mode == "record":
+                index_offset = self._file.tell()
+                for entry in sorted(self._index):
+                    self._file.write(INDEX_ENTRY.pack(*entry))
+                self._file.write(FOOTER.pack(index_offset, len(self._index), MAGIC))
+                self._file.close()
+                self._file = None
+            elif self.mode == "replay":
+                self._map.close()
+                self._map = None
+            self.mode = None
+
+
+def _bisect(value_at, count: int, target: int) -> int:
+    """Return the first position in 0..count whose value is not below target."""
+    low, high = 0, count
+    while low < high:
+        middle = (low + high) // 2
+        if value_at(middle) < target:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+CASSETTE = Cassette()
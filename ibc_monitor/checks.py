@@ -0,0 +1,398 @@
+"""The checks: what to query for each path and how to report on the output."""
+import abc
+import contextlib
+import datetime
+import logging
+import math
+import threading
+import time
+
+from . import settings
+from .alerts import ALERTS, raise_alert
+from .history import BALANCE_HISTORY, EXPIRATION_CACHE, PACKET_AGES, report_balance_trend, stuck_packets
+from .metrics import BALANCE_GAUGE, CLIENT_EXPIRY_GAUGE, UNRELAYED_PACKET_AGE_GAUGE, UNRELAYED_PACKETS_GAUGE
+from .parsers import (ParseError, parse_balance, parse_client_expiration, parse_expiring_clients,
+                      summarize_unrelayed_packets, unrelayed_sequences)
+from .profiling import PROFILER
+from .queries import Check, CheckExecutor
+from .rules import KINDS, Observations
+from .sharding import SHARD
+from .thresholds import rule_set, threshold_index
+
+
+def check_expiration(namespace: str, relayer: str, path: str) -> Check:
+    """
+    Check the expiration of clients on a given path.
+
+    Args:
+        namespace (str): The namespace in which the relayer is deployed.
+        relayer (str): The name of the relayer.
+        path (str): The path to check the expiration of clients.
+
+    Returns:
+        Check: The query and report for the path.
+    """
+    logging.debug(f"Checking for expirations on: {path}")
+    args = ('q', 'clients-expiration', path)
+    cached = EXPIRATION_CACHE.cached_output(path)
+    if cached is not None:
+        logging.debug(f"Using cached expirations for: {path}")
+        return Check(namespace, relayer, args, report_expiration, cached)
+    return Check(namespace, relayer, args,
+                 lambda output: report_expiration(output, path))
+
+
+def report_expiration(output: str, path: str = None):
+    """Report on the output of 'rly q clients-expiration', caching it for the path if given."""
+    try:
+        if path is not None:
+            EXPIRATION_CACHE.store(path, output)
+        expiring_clients = parse_expiring_clients(output)
+        observe_expiring_clients(expiring_clients)
+    except Exception as e:
+        logging.error(f"Error while parsing expiring clients: {e}")
+
+
+def check_expirations(category) -> list:
+    """
+    Check the expiration of clients on every path of a category.
+
+    Args:
+        category (str): The category of paths to check.
+
+    Returns:
+        list: The checks for each path in the category.
+    """
+    category_paths = settings.CONFIG["paths"].get(category)
+    if category_paths is None:
+        logging.error(f"Category '{category}' not found in the configuration.")
+        return []
+
+    namespace = settings.CONFIG["namespaces"].get(category)
+    if namespace is None:
+        logging.error(f"Namespace not found for category '{category}'.")
+        return []
+
+    relayer = settings.CONFIG["relayers"].get(category)
+    if relayer is None:
+        logging.error(f"Relayer not found for category '{category}'.")
+        return []
+
+    return [check_expiration(namespace, relayer, key) for key in category_paths if SHARD.owns(category, key)]
+
+
+def check_unrelayed_packets(namespace: str, relayer: str, path: str, path_data: dict) -> Check:
+    """
+    Check for unrelayed packets on a given path.
+
+    Args:
+        namespace (str): The namespace in which the relayer is deployed.
+        relayer (str): The name of the relayer.
+        path (str): The path to check for unrelayed packets.
+        path_data (dict): The configuration of the path.
+
+    Returns:
+        Check: The query and report for the path.
+    """
+    logging.debug(
+        f"Checking for unrelayed-packets on chain_name: {path_data['chain_name']}")
+    args = ('q', 'unrelayed-packets', path, path_data['channel'])
+    return Check(namespace, relayer, args,
+                 lambda output: report_unrelayed_packets(path, path_data, output))
+
+
+def report_unrelayed_packets(path: str, path_data: dict, output: str):
+    """Report on the output of 'rly q unrelayed-packets', tracking how long each sequence has been pending."""
+    summaries = summarize_unrelayed_packets(output)
+    populated = summaries["src"].present or summaries["dst"].present
+    UNRELAYED_PACKETS_GAUGE.set(int(populated), path_data['chain_name'], path_data['channel'])
+    # A backlog can print megabytes of sequences, only copied into a message when shown
+    if populated and logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug(f"Unrelayed packets on chain_name: {path_data['chain_name']}\n{output}")
+    if populated and settings.CONFIG["show_unrelayed_sequences"]:
+        for direction, summary in summaries.items():
+            if summary.count:
+                sequences = ",".join(map(str, unrelayed_sequences(output, direction)))
+                logging.info(f"Unrelayed {direction} sequences on chain_name: {path_data['chain_name']} "
+                             f"{path_data['channel']}: {sequences}")
+    now = time.time()
+    stuck_after = settings.CONFIG["packet_ages"]["stuck_after"]
+    stuck, oldest = 0, None
+    for direction, summary in summaries.items():
+        runs = PACKET_AGES.update(f"{path}/{path_data['channel']}/{direction}", summary.ranges, now)
+        count, age = stuck_packets(runs, now, stuck_after)
+        stuck += count
+        if age is not None and (oldest is None or age > oldest):
+            oldest = age
+    UNRELAYED_PACKET_AGE_GAUGE.set(oldest or 0, path_data['chain_name'], path_data['channel'])
+    with evaluation_cycle() as observations:
+        observations.record("unrelayed", chain=path_data['chain_name'], channel=path_data['channel'],
+                            src_summary=str(summaries["src"]), dst_summary=str(summaries["dst"]),
+                            unrelayed=summaries["src"].count + summaries["dst"].count,
+                            src=summaries["src"].count, dst=summaries["dst"].count, populated=int(populated),
+                            stuck=stuck, age=oldest, stuck_after=stuck_after)
+
+
+def check_low_path_balance(namespace: str, relayer: str, path: dict, category: str) -> Check:
+    """
+    Check if the balance of a chain_name is below the low balance threshold.
+
+    Args:
+        namespace (str): The namespace in which the relayer is deployed.
+        relayer (str): The name of the relayer.
+        path (dict): The path to check the balance.
+        category (str): The category of the path.
+
+    Returns:
+        Check: The query and report for the path.
+    """
+    logging.debug(
+        f"Checking for low balance on chain_name: {path['chain_name']}")
+    return Check(namespace, relayer, ('q', 'balance', path['chain_name']),
+                 lambda output: report_low_path_balance(category, path, output))
+
+
+def report_low_path_balance(category: str, path: dict, output: str):
+    """Report on the output of 'rly q balance' for a path."""
+    balance_data = parse_balance(output)
+    observe_balances(category, path['chain_name'], balance_data['balances'],
+                     threshold_index().paths.get((category, path['chain_name']), {}))
+
+
+def check_low_native_balance(namespace: str, relayer: str, chain_name: str) -> Check:
+    """
+    Check if the balance of a category's wallet on its own chain is below the low balance threshold.
+
+    Args:
+        namespace (str): The namespace in which the relayer is deployed.
+        relayer (str): The name of the relayer.
+        chain_name (str): The category, which is also the chain_name of its own chain.
+
+    Returns:
+        Check: The query and report for the chain.
+    """
+    logging.debug(
+        f"Checking for low balance on chain_name: {chain_name}")
+    return Check(namespace, relayer, ('q', 'balance', chain_name),
+                 lambda output: report_low_native_balance(chain_name, output))
+
+
+def report_low_native_balance(chain_name: str, output: str):
+    """Report on the output of 'rly q balance' for a native chain."""
+    balance_data = parse_balance(output)
+    observe_balances(chain_name, chain_name, balance_data['balances'], threshold_index().native.get(chain_name, {}))
+
+
+def observe_balances(category: str, chain_name: str, balances: list, thresholds: dict):
+    """
+    Record each monitored balance for the alert rules.
+
+    Each category's relayer has its own wallet on a chain, so balances are
+    kept apart per category as well as per chain_name and denom.
+
+    Args:
+        category (str): The category whose relayer owns the wallet.
+        chain_name (str): The chain_name the balances belong to.
+        balances (list): The balances from parse_balance.
+        thresholds (dict): The thresholds of the wallet by denom, from the ThresholdIndex.
+    """
+    with evaluation_cycle() as observations:
+        for balance in balances:
+            amount = balance['amount']
+            denom = balance['denom']
+            BALANCE_GAUGE.set(amount, category, chain_name, denom)
+            threshold = thresholds.get(denom)
+            if threshold is None:
+                continue
+            observations.record("balance", chain=chain_name, denom=denom, category=category, balance=amount,
+                                warn=threshold.warn, error=threshold.error)
+
+
+def observe_expiring_clients(expiring_clients: list):
+    """
+    Record the remaining lifetime of each client for the alert rules.
+
+    Args:
+        expiring_clients (list): A list of expiring clients.
+    """
+    now = datetime.datetime.now()
+    with evaluation_cycle() as observations:
+        for client in expiring_clients:
+            try:
+                client_id, chain_id, expiration_date = parse_client_expiration(client)
+            except ParseError as e:
+                logging.error(f"Unexpected output from rly q clients-expiration: {e}")
+                continue
+            remaining_time = expiration_date - now
+            CLIENT_EXPIRY_GAUGE.set(remaining_time.total_seconds(), client_id, chain_id)
+            days = remaining_time.days
+            hours, remainder = divmod(remaining_time.seconds, 3600)
+            minutes, seconds = divmod(remainder, 60)
+            observations.record("expiration", chain=chain_id, client=client_id,
+                                remaining=f"{days} days {hours} hours {minutes} minutes {seconds} seconds",
+                                expires_in=remaining_time / datetime.timedelta(days=1),
+                                warn=settings.CONFIG["expiration_days_threshold_warning"],
+                                error=settings.CONFIG["expiration_days_threshold_error"])
+
+
+_cycle = threading.local()
+# The latest number of unrelayed packets per (chain_name, channel), so rules on
+# balances can use packets seen by an earlier run of the unrelayed checks
+_unrelayed_packets = {}
+_unrelayed_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def evaluation_cycle():
+    """
+    Collect what the checks inside the block observe and evaluate the alert rules once at the end.
+
+    Cycles do not nest: inside a cycle, the observations join the outer one.
+    Checks reported outside of any cycle are evaluated per output.
+
+    Yields:
+        Observations: The observations of the cycle.
+    """
+    observations = getattr(_cycle, "observations", None)
+    if observations is not None:
+        yield observations
+        return
+    observations = _cycle.observations = Observations()
+    try:
+        yield observations
+    finally:
+        _cycle.observations = None
+    report_observations(observations)
+
+
+def report_observations(observations: Observations):
+    """
+    Evaluate the alert rules over the observations of a cycle and report on each row in order.
+
+    Matching rules raise alerts, a row without any is logged as ok, and every
+    balance is added to the balance history.
+
+    Args:
+        observations (Observations): The observations of the cycle.
+    """
+    if not observations.order:
+        return
+    unrelayed = observations.tables["unrelayed"]
+    with _unrelayed_lock:
+        _unrelayed_packets.update(zip(zip(unrelayed["chain"], unrelayed["channel"]), unrelayed["unrelayed"]))
+        packets = dict(_unrelayed_packets)
+    observations.derive("balance", "unrelayed", lambda table: unrelayed_per_chain(table, packets))
+    observations.derive("balance", "baseline", balance_baselines)
+    with PROFILER.span("evaluate", "rules"):
+        matches = rule_set().evaluate(observations)
+
+    for kind, row in observations.order:
+        fields = observations.row(kind, row)
+        rules = matches.get((kind, row))
+        if rules is None:
+            logging.info(KINDS[kind].ok.format(**fields))
+        for rule in rules or ():
+            if rule.level < logging.WARNING:
+                logging.log(rule.level, rule.message.format(**fields))
+            else:
+                raise_alert(rule.level, fields["chain"], rule.subject.format(**fields), rule.message.format(**fields),
+                            fields.get("category", ""))
+        if kind == "balance":
+            report_balance_trend(fields["category"], fields["chain"], fields["denom"], fields["balance"])
+
+
+def unrelayed_per_chain(table: dict, packets: dict) -> list:
+    """Return the unrelayed packets over all channels of the chain_name of each balance."""
+    per_chain = {}
+    for (chain_name, _), count in packets.items():
+        per_chain[chain_name] = per_chain.get(chain_name, 0) + count
+    return [per_chain.get(chain_name, math.nan) for chain_name in table["chain"]]
+
+
+def balance_baselines(table: dict) -> list:
+    """Return the mean balance in the history of each balance, the current one excluded."""
+    keys = list(zip(table["category"], table["chain"], table["denom"]))
+    baselines = BALANCE_HISTORY.baselines(keys) if BALANCE_HISTORY.path else {}
+    return [baselines.get(key, math.nan) for key in keys]
+
+
+class Checker(abc.ABC):
+    """
+    One type of check, run over the paths of every category this replica owns.
+
+    The checks are built from the current configuration, so a checker can be
+    used without the command line interface:
+
+        use_config(ConfigFile("config.yaml").load())
+        BalanceChecker().run()
+
+    Args:
+        executor (CheckExecutor): Runs the checks, by default a new executor with the configured limits.
+    """
+
+    def __init__(self, executor: CheckExecutor = None):
+        self.executor = executor
+
+    @abc.abstractmethod
+    def category_checks(self, category: str) -> list:
+        """Build the checks for the paths of a category."""
+
+    def checks(self) -> list:
+        """Build the checks for every category, in reporting order."""
+        return [check for category in settings.CONFIG["paths"] for check in self.category_checks(category)]
+
+    def run(self):
+        """Run the checks, report on each output and send the alerts they raised."""
+        executor = self.executor or CheckExecutor.from_config()
+        with evaluation_cycle():
+            executor.run(self.checks())
+        ALERTS.flush()
+
+
+def owned_paths(category: str) -> dict:
+    """Return the paths of a category that this replica checks."""
+    return {name: path for name, path in settings.CONFIG["paths"][category].items() if SHARD.owns(category, name)}
+
+
+class ExpirationChecker(Checker):
+    """Warn about IBC clients that are about to expire."""
+
+    def category_checks(self, category: str) -> list:
+        logging.debug(f"Checking for expirations on {category} paths:")
+        return check_expirations(category)
+
+    def run(self):
+        super().run()
+        EXPIRATION_CACHE.save()
+
+
+class UnrelayedChecker(Checker):
+    """Warn about packets waiting to be relayed for longer than packet_ages.stuck_after."""
+
+    def category_checks(self, category: str) -> list:
+        logging.debug(f"Checking for unrelayed-packets on {category} paths:")
+        namespace = settings.CONFIG["namespaces"][category]
+        relayer = settings.CONFIG["relayers"][category]
+        return [check_unrelayed_packets(namespace, relayer, name, path)
+                for name, path in owned_paths(category).items()]
+
+    def run(self):
+        super().run()
+        PACKET_AGES.save()
+
+
+class BalanceChecker(Checker):
+    """Warn about low wallet balances, on a category's own chain and on each path."""
+
+    def category_checks(self, category: str) -> list:
+        logging.debug(f"Checking for low balance on {category} paths:")
+        namespace = settings.CONFIG["namespaces"][category]
+        relayer = settings.CONFIG["relayers"][category]
+        checks = []
+        if SHARD.owns(category):
+            checks.append(check_low_native_balance(namespace, relayer, category))
+        for path in owned_paths(category).values():
+            # A path without tokens has no threshold to compare its balances with
+            if path.get("tokens"):
+                checks.append(check_low_path_balance(namespace, relayer, path, category))
+        return checks
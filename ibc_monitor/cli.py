@@ -0,0 +1,370 @@
+"""The command line interface."""
+import argparse
+import logging
+import random
+import signal
+import sys
+import threading
+import time
+from typing import Callable
+
+from . import settings
+from .alerts import ALERTS
+from .cassette import CASSETTE
+from .checks import BalanceChecker, ExpirationChecker, UnrelayedChecker, evaluation_cycle
+from .discovery import DISCOVERY
+from .history import EXPIRATION_CACHE, PACKET_AGES
+from .logs import LOG_PIPELINE
+from .metrics import start_metrics_server
+from .profiling import PROFILER
+from .queries import QUERY_CACHE, CheckExecutor, cluster_workers, relayer_limits
+from .runtime import use_config
+from .settings import DEFAULT_CONFIG_FILE, ConfigError, ConfigFile
+from .sharding import SHARD
+
+
+def positive_int(text: str) -> int:
+    """Parse a command line argument that must be a positive integer."""
+    value = int(text)
+    if value <= 0:
+        raise argparse.ArgumentTypeError(f"{text} is not a positive integer")
+    return value
+
+
+# Create the parser
+parser = argparse.ArgumentParser(description="Run checks")
+
+# Add the arguments
+parser.add_argument('--config', default=None,
+                    help='YAML, TOML or JSON file with the paths and thresholds to monitor')
+parser.add_argument('--expiration', action='store_true',
+                    help='Check for expirations')
+parser.add_argument('--unrelayed', action='store_true',
+                    help='Check for unrelayed packets')
+parser.add_argument('--balance', action='store_true',
+                    help='Check for low balance')
+parser.add_argument('--all', action='store_true',
+                    help='Check all')
+parser.add_argument('--workers', type=positive_int,
+                    help='Maximum number of relayer queries to run at once')
+parser.add_argument('--batch', action='store_true',
+                    help='Run all queries for a relayer with a single kubectl exec')
+parser.add_argument('--daemon', action='store_true',
+                    help='Keep running and repeat each check on its own interval')
+parser.add_argument('--balance-backend', choices=['kubectl', 'lcd'],
+                    help='Query balances through the relayer or directly from LCD endpoints')
+parser.add_argument('--metrics-port', type=positive_int,
+                    help='Serve Prometheus metrics on this port')
+parser.add_argument('--history',
+                    help='Keep balance history in this SQLite file and warn before balances run out')
+parser.add_argument('--expiration-cache',
+                    help='Keep client expiration dates in this file and only re-query paths close to expiring')
+parser.add_argument('--packet-ages',
+                    help='Keep the first time each unrelayed packet was seen in this file between runs')
+parser.add_argument('--show-sequences', action='store_true',
+                    help='Log every pending sequence of the channels with unrelayed packets')
+parser.add_argument('--shard-dir',
+                    help='Share the paths with other replicas holding leases in this directory')
+parser.add_argument('--shard-id',
+                    help='Name of this replica among the shards, hostname and pid by default')
+parser.add_argument('--discover', action='store_true',
+                    help="Also monitor the paths configured in each relayer")
+parser.add_argument('--discovery-cache',
+                    help='Keep discovered paths in this file between runs')
+parser.add_argument('--log-format', choices=['text', 'json', 'logfmt'],
+                    help='Write log lines as colored text, JSON or logfmt')
+parser.add_argument('--profile', action='store_true',
+                    help='Print how long each stage of the run took')
+parser.add_argument('--profile-top', type=int, default=10,
+                    help='Number of slowest calls listed by --profile')
+parser.add_argument('--profile-output',
+                    help='Write a cProfile dump of the run to this file')
+cassette = parser.add_mutually_exclusive_group()
+cassette.add_argument('--record', metavar='FILE',
+                      help='Record every kubectl and rly command with its output and timing to this cassette')
+cassette.add_argument('--replay', metavar='FILE',
+                      help='Serve kubectl and rly outputs from this cassette instead of running them')
+
+
+def apply_arguments(args, config: dict):
+    """Let command line arguments take precedence over the config file."""
+    if args.workers:
+        config["max_workers"] = args.workers
+    if args.batch:
+        config["batch_queries"] = True
+    if args.balance_backend:
+        config["balance_backend"] = args.balance_backend
+    if args.replay:
+        # LCD queries are HTTP requests, which are not recorded
+        config["balance_backend"] = "kubectl"
+    if args.metrics_port:
+        config["metrics_port"] = args.metrics_port
+    if args.history:
+        config["balance_history"]["path"] = args.history
+    if args.expiration_cache:
+        config["expiration_cache"]["path"] = args.expiration_cache
+    if args.packet_ages:
+        config["packet_ages"]["path"] = args.packet_ages
+    if not args.daemon and not config["packet_ages"]["path"]:
+        # A single run cannot tell how long a packet has been pending, so it
+        # reports every pending packet rather than none
+        config["packet_ages"]["stuck_after"] = 0
+    if args.show_sequences:
+        config["show_unrelayed_sequences"] = True
+    if args.log_format:
+        config["log_format"] = args.log_format
+    if args.shard_dir:
+        config["sharding"].update(enabled=True, backend="file", lease_dir=args.shard_dir)
+    if args.shard_id:
+        config["sharding"]["member_id"] = args.shard_id
+    if args.discover:
+        config["discovery"]["enabled"] = True
+    if args.discovery_cache:
+        config["discovery"]["cache_path"] = args.discovery_cache
+
+
+CONFIG_FILE = None
+
+
+def reload_config() -> bool:
+    """
+    Swap in the config file if it changed on disk.
+
+    Returns:
+        bool: True if a new configuration was swapped in.
+    """
+    if CONFIG_FILE is None:
+        return False
+    config = CONFIG_FILE.reload_if_changed()
+    if config is None:
+        return False
+    use_config(config)
+    logging.info(f"Reloaded configuration from {CONFIG_FILE.path}")
+    return True
+
+
+def plan_checks(args) -> list:
+    """
+    Build the checks selected by the command line arguments, in reporting order.
+
+    Args:
+        args (argparse.Namespace): The parsed command line arguments.
+
+    Returns:
+        list: The checks to run.
+    """
+    selected = {kind for kind in ("expiration", "unrelayed", "balance") if getattr(args, kind)}
+    if args.all:
+        # Expirations are only checked when asked for
+        selected |= {"unrelayed", "balance"}
+    # Each kind runs once, in the same order whichever flags selected it
+    checkers = [checker() for kind, checker in (("expiration", ExpirationChecker), ("unrelayed", UnrelayedChecker),
+                                                ("balance", BalanceChecker)) if kind in selected]
+
+    checks = []
+    for category in settings.CONFIG["paths"]:
+        for checker in checkers:
+            checks += checker.category_checks(category)
+    return checks
+
+
+def run_checks(executor: CheckExecutor, args):
+    """
+    Run the checks selected by the arguments and persist what they learned.
+
+    Args:
+        executor (CheckExecutor): The executor running the checks.
+        args (argparse.Namespace): The selected check types.
+    """
+    if reload_config():
+        executor.configure(settings.CONFIG["max_workers"], relayer_limits(),
+                           settings.CONFIG["default_relayer_concurrency"], settings.CONFIG["batch_queries"],
+                           cluster_workers())
+    if settings.CONFIG["discovery"]["enabled"]:
+        DISCOVERY.discover(executor, settings.CONFIG)
+        DISCOVERY.save()
+    SHARD.refresh()
+    with evaluation_cycle():
+        executor.run(plan_checks(args))
+    ALERTS.flush()
+    EXPIRATION_CACHE.save()
+    PACKET_AGES.save()
+
+
+class ScheduledJob:
+    """A job run by the Scheduler on a fixed interval."""
+
+    def __init__(self, name: str, interval: float, func: Callable[[], None]):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.next_run = 0.0
+        self.thread = None
+
+
+class Scheduler:
+    """
+    Run jobs on their own intervals until stopped.
+
+    Each run happens on its own thread so a slow job never delays the others.
+    A run is skipped when the previous run of the same job is still going.
+    """
+
+    def __init__(self, jitter: float = 0.0):
+        self.jitter = jitter
+        self.jobs = []
+        self._stopping = threading.Event()
+
+    def add(self, name: str, interval: float, func: Callable[[], None]):
+        """
+        Schedule a job.
+
+        Args:
+            name (str): The name of the job, used in log messages.
+            interval (float): The number of seconds between runs.
+            func (Callable[[], None]): The job itself.
+        """
+        self.jobs.append(ScheduledJob(name, interval, func))
+
+    def stop(self):
+        """Ask the scheduler to stop once the running jobs have finished."""
+        self._stopping.set()
+
+    def _delay(self, job: ScheduledJob) -> float:
+        return job.interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def _run_job(self, job: ScheduledJob):
+        started = time.monotonic()
+        try:
+            job.func()
+        except Exception as e:
+            logging.error(f"Scheduled {job.name} check failed: {e}")
+        logging.debug(f"Scheduled {job.name} check finished in {time.monotonic() - started:.1f}s")
+
+    def run(self):
+        """Run the jobs until stop is called, then wait for the running jobs."""
+        for job in self.jobs:
+            job.next_run = time.monotonic()
+        while not self._stopping.is_set():
+            now = time.monotonic()
+            for job in self.jobs:
+                if job.next_run > now:
+                    continue
+                job.next_run = now + self._delay(job)
+                if job.thread is not None and job.thread.is_alive():
+                    logging.warning(f"Skipping {job.name} check, the previous run is still going.")
+                    continue
+                job.thread = threading.Thread(target=self._run_job, args=(job,),
+                                              name=f"check-{job.name}")
+                job.thread.start()
+            next_run = min(job.next_run for job in self.jobs)
+            self._stopping.wait(max(0.0, next_run - time.monotonic()))
+
+        for job in self.jobs:
+            if job.thread is not None:
+                job.thread.join()
+
+
+def run_daemon(args, executor: CheckExecutor):
+    """
+    Repeat the selected check types on their configured intervals until SIGTERM or SIGINT.
+
+    Every check type is scheduled when none is selected. Discovered paths, the
+    executor and the query cache are kept between runs.
+
+    Args:
+        args (argparse.Namespace): The parsed command line arguments.
+        executor (CheckExecutor): The executor running every check.
+    """
+    selected = {
+        "expiration": args.expiration,
+        "unrelayed": args.unrelayed or args.all,
+        "balance": args.balance or args.all,
+    }
+    if not any(selected.values()):
+        selected = dict.fromkeys(selected, True)
+
+    scheduler = Scheduler(settings.CONFIG["daemon_jitter"])
+    for check_type, enabled in selected.items():
+        if not enabled:
+            continue
+        check_args = argparse.Namespace(expiration=False, unrelayed=False, balance=False, all=False)
+        setattr(check_args, check_type, True)
+        scheduler.add(check_type, settings.CONFIG["daemon_intervals"][check_type],
+                      lambda check_args=check_args: run_checks(executor, check_args))
+
+    # Cached outputs must not outlive the shortest interval, or a run could
+    # report what the previous run already saw
+    shortest = min(job.interval for job in scheduler.jobs)
+    QUERY_CACHE.max_ttl = shortest * (1 - settings.CONFIG["daemon_jitter"]) / 2
+
+    if SHARD.enabled:
+        # Renew the lease well before it expires, even between long check intervals
+        scheduler.add("lease", SHARD.lease_ttl / 3, SHARD.refresh)
+
+    def shutdown(signum, frame):
+        logging.info(f"Received {signal.Signals(signum).name}, shutting down.")
+        scheduler.stop()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    logging.info("Running in daemon mode: " + ", ".join(
+        f"{job.name} every {job.interval}s" for job in scheduler.jobs))
+    scheduler.run()
+    SHARD.release()
+
+
+def main(argv=None):
+    # Parse the arguments
+    args = parser.parse_args(argv)
+
+    if not args.expiration and not args.unrelayed and not args.balance and not args.all and not args.daemon:
+        parser.print_help()
+        sys.exit(1)
+
+    LOG_PIPELINE.start(args.log_format or settings.CONFIG["log_format"])
+
+    global CONFIG_FILE
+    CONFIG_FILE = ConfigFile(args.config or DEFAULT_CONFIG_FILE,
+                             lambda config: apply_arguments(args, config))
+    try:
+        use_config(CONFIG_FILE.load())
+    except ConfigError as e:
+        logging.error(str(e))
+        sys.exit(1)
+    try:
+        if args.record:
+            CASSETTE.start_recording(args.record)
+        elif args.replay:
+            CASSETTE.start_replay(args.replay)
+    except OSError as e:
+        logging.error(str(e))
+        sys.exit(1)
+    if settings.CONFIG["metrics_port"]:
+        start_metrics_server(settings.CONFIG["metrics_port"])
+
+    if args.profile or args.profile_output:
+        PROFILER.enable()
+    profile = None
+    if args.profile_output:
+        import cProfile
+        profile = cProfile.Profile()
+    if profile is not None:
+        profile.enable()
+
+    executor = CheckExecutor.from_config()
+    if args.daemon:
+        run_daemon(args, executor)
+    else:
+        run_checks(executor, args)
+
+    ALERTS.close(settings.CONFIG["alert_timeout"])
+
+    if profile is not None:
+        profile.disable()
+        # Only the main thread is profiled: discovery, parsing and evaluation
+        profile.dump_stats(args.profile_output)
+    CASSETTE.close()
+    LOG_PIPELINE.stop()
+    if args.profile:
+        print(PROFILER.report(args.profile_top), file=sys.stderr)
@@ -0,0 +1,142 @@
+"""Path entries generated from the relayers' own configuration."""
+import logging
+import threading
+import time
+
+from . import settings
+from .parsers import ParseError, parse_balance, parse_chain_names, parse_discovered_paths
+from .profiling import PROFILER
+from .queries import Check
+from .state import JSONState
+
+
+class PathDiscovery(JSONState):
+    """
+    Path entries generated from the configuration of each category's relayer.
+
+    The relayer's 'rly paths list --json' and 'rly chains list --json' give the
+    counterparty chain_name and channel of every path, and 'rly q balance' the
+    denoms observed on it. Discovered paths are kept for ttl seconds, in memory
+    and in an optional JSON file, and never replace a path of the config file.
+    Each denom of a discovered path is given the discovery.default_alerts
+    thresholds, so without them the path's balance is not checked.
+
+    Threads asking for discovery at the same time share a single one: the
+    others wait for it and then find the paths fresh.
+    """
+    description = "discovery cache"
+
+    def __init__(self, path: str, ttl: float):
+        super().__init__(path)
+        self.ttl = ttl
+        self._discovering = threading.Lock()
+
+    def _entry(self, category: str) -> dict:
+        with self._lock:
+            return self._load().get(category)
+
+    def _is_fresh(self, category: str, source: str) -> bool:
+        entry = self._entry(category)
+        return entry is not None and entry["source"] == source and time.time() - entry["discovered_at"] < self.ttl
+
+    def discover(self, executor, config: dict):
+        """
+        Add the discovered paths of every category with a relayer to config["paths"].
+
+        Categories whose discovered paths are older than ttl are discovered again
+        first, all of them in one run of the executor. config["paths"] is
+        replaced rather than changed, so threads iterating it are unaffected.
+
+        Args:
+            executor (CheckExecutor): The executor running the rly queries.
+            config (dict): The configuration to add the paths to.
+        """
+        sources = {category: f"{config['namespaces'].get(category)}/{relayer}"
+                   for category, relayer in config["relayers"].items()}
+        with self._discovering:
+            stale = [category for category, source in sources.items() if not self._is_fresh(category, source)]
+            if stale:
+                with PROFILER.span("discovery", ",".join(stale)):
+                    self._discover(executor, config, stale, sources)
+
+        paths = dict(config["paths"])
+        for category in sources:
+            entry = self._entry(category)
+            if entry is None:
+                continue
+            missing = {name: discovered_path(path, config["discovery"]["default_alerts"])
+                       for name, path in entry["paths"].items() if name not in paths.get(category, {})}
+            if missing:
+                paths[category] = {**paths.get(category, {}), **missing}
+        if len(paths) != len(config["paths"]) or any(paths[category] is not config["paths"].get(category)
+                                                     for category in paths):
+            config["paths"] = paths
+
+    def _discover(self, executor, config: dict, categories: list, sources: dict):
+        outputs = {}
+
+        def collect(key):
+            return lambda output: outputs.__setitem__(key, output)
+
+        checks = []
+        for category in categories:
+            namespace = config["namespaces"].get(category)
+            relayer = config["relayers"][category]
+            checks.append(Check(namespace, relayer, ('paths', 'list', '--json'), collect((category, "paths"))))
+            checks.append(Check(namespace, relayer, ('chains', 'list', '--json'), collect((category, "chains"))))
+        executor.run(checks)
+
+        discovered = {}
+        checks = []
+        for category in categories:
+            paths_output = outputs.get((category, "paths"))
+            chains_output = outputs.get((category, "chains"))
+            if not paths_output or not chains_output:
+                # Tried again on the next run
+                logging.error(f"Could not discover the paths of {category}")
+                continue
+            try:
+                paths = parse_discovered_paths(category, paths_output, parse_chain_names(chains_output))
+            except ParseError as e:
+                logging.error(f"Could not discover the paths of {category}: {e}")
+                continue
+            discovered[category] = paths
+            namespace = config["namespaces"].get(category)
+            relayer = config["relayers"][category]
+            for chain_name in sorted({path["chain_name"] for path in paths.values()}):
+                checks.append(Check(namespace, relayer, ('q', 'balance', chain_name),
+                                    collect((category, chain_name))))
+        # The balance checks of this run are answered from the query cache
+        executor.run(checks)
+
+        now = time.time()
+        for category, paths in discovered.items():
+            for path in paths.values():
+                output = outputs.get((category, path["chain_name"]))
+                try:
+                    path["denoms"] = [balance["denom"] for balance in parse_balance(output)["balances"]] if output else []
+                except ParseError as e:
+                    logging.error(f"Could not find the denoms of {path['chain_name']}: {e}")
+                    path["denoms"] = []
+            with self._lock:
+                self._load()[category] = {"source": sources[category], "discovered_at": now, "paths": paths}
+                self._dirty = True
+            logging.info(f"Discovered {len(paths)} paths of {category}")
+
+
+def discovered_path(path: dict, default_alerts: dict) -> dict:
+    """
+    Build the path entry of a discovered path.
+
+    Args:
+        path (dict): The discovered path, with the denoms observed on it.
+        default_alerts (dict): The thresholds given to each denom, or None.
+
+    Returns:
+        dict: The path entry, with a token per denom when there are thresholds.
+    """
+    tokens = {denom: {"alerts": dict(default_alerts)} for denom in path.get("denoms", [])} if default_alerts else {}
+    return {**path, "tokens": tokens}
+
+
+DISCOVERY = PathDiscovery(settings.CONFIG["discovery"]["cache_path"], settings.CONFIG["discovery"]["ttl"])
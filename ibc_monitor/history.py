@@ -0,0 +1,427 @@
+"""Persistent balance history, client expiration cache and pending packet ages."""
+import datetime
+import logging
+import threading
+import time
+
+from . import settings
+from .alerts import raise_alert
+from .metrics import TIME_TO_EMPTY_GAUGE
+from .parsers import ParseError, parse_client_expiration, parse_expiring_clients
+from .state import JSONState
+
+
+class BalanceHistory:
+    """
+    Persistent balance samples per (category, chain_name, denom), stored in SQLite.
+
+    Each key keeps a fixed-size ring buffer of samples, so the store never
+    grows past capacity samples per wallet. Alongside the ring, each key
+    tracks its latest sample, the sample taken right after its last refill,
+    and the sum and number of the samples in its ring. That makes appending
+    a sample, projecting when the balance runs out and taking the mean
+    balance each a primary key lookup. Each key also records the capacity
+    its ring was laid out for, and the ring of a key is rebuilt with its
+    newest samples on the first append after the capacity changed.
+    """
+
+    def __init__(self, path: str, capacity: int):
+        self.path = path
+        self.capacity = capacity
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._connection is None:
+            import sqlite3
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            columns = {row[1] for row in connection.execute("PRAGMA table_info(balance_series)")}
+            if columns and "category" not in columns:
+                # A history written before wallets were told apart by category
+                # cannot say whose wallet a sample was taken from
+                logging.warning(f"Starting the balance history {self.path} over, it has no categories")
+                with connection:
+                    connection.executescript("DROP TABLE balance_series; DROP TABLE IF EXISTS balance_samples;")
+            connection.executescript("""
+                PRAGMA journal_mode = WAL;
+                PRAGMA synchronous = NORMAL;
+                CREATE TABLE IF NOT EXISTS balance_series (
+                    category TEXT NOT NULL,
+                    chain_name TEXT NOT NULL,
+                    denom TEXT NOT NULL,
+                    head INTEGER NOT NULL,
+                    last_timestamp REAL NOT NULL,
+                    last_amount INTEGER NOT NULL,
+                    anchor_timestamp REAL NOT NULL,
+                    anchor_amount INTEGER NOT NULL,
+                    total REAL NOT NULL,
+                    samples INTEGER NOT NULL,
+                    capacity INTEGER NOT NULL,
+                    PRIMARY KEY (category, chain_name, denom)
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS balance_samples (
+                    category TEXT NOT NULL,
+                    chain_name TEXT NOT NULL,
+                    denom TEXT NOT NULL,
+                    slot INTEGER NOT NULL,
+                    timestamp REAL NOT NULL,
+                    amount INTEGER NOT NULL,
+                    PRIMARY KEY (category, chain_name, denom, slot)
+                ) WITHOUT ROWID;
+            """)
+            columns = {row[1] for row in connection.execute("PRAGMA table_info(balance_series)")}
+            if "capacity" not in columns:
+                # A history written before the capacity was kept, which the
+                # mismatch rebuilds on the next append of each key
+                with connection:
+                    connection.execute("ALTER TABLE balance_series ADD COLUMN capacity INTEGER NOT NULL DEFAULT 0")
+            self._connection = connection
+        return self._connection
+
+    def _resize(self, connection, key: tuple) -> tuple:
+        """Lay the ring of a key out again for the current capacity, keeping its newest samples."""
+        rows = connection.execute(
+            "SELECT timestamp, amount FROM balance_samples WHERE category = ? AND chain_name = ? AND denom = ? "
+            "ORDER BY timestamp DESC LIMIT ?", (*key, self.capacity)).fetchall()
+        rows.reverse()
+        connection.execute("DELETE FROM balance_samples WHERE category = ? AND chain_name = ? AND denom = ?", key)
+        connection.executemany("INSERT INTO balance_samples VALUES (?, ?, ?, ?, ?, ?)",
+                               [(*key, slot, timestamp, amount) for slot, (timestamp, amount) in enumerate(rows)])
+        return len(rows), sum(amount for _, amount in rows), len(rows)
+
+    def append(self, category: str, chain_name: str, denom: str, amount: int, timestamp: float = None) -> float:
+        """
+        Record a balance sample and project when the balance runs out.
+
+        Args:
+            category (str): The category whose relayer owns the wallet.
+            chain_name (str): The chain_name of the wallet.
+            denom (str): The denom of the balance.
+            amount (int): The balance.
+            timestamp (float): The time of the sample, defaults to now.
+
+        Returns:
+            float: The projected number of seconds until the balance is empty,
+                or None when the balance is not decreasing.
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                row = connection.execute(
+                    "SELECT head, last_amount, anchor_timestamp, anchor_amount, total, samples, capacity "
+                    "FROM balance_series WHERE category = ? AND chain_name = ? AND denom = ?",
+                    (category, chain_name, denom)).fetchone()
+                if row is None:
+                    head, anchor_timestamp, anchor_amount, total, samples = 0, timestamp, amount, 0, 0
+                else:
+                    head, last_amount, anchor_timestamp, anchor_amount, total, samples, capacity = row
+                    if capacity != self.capacity:
+                        head, total, samples = self._resize(connection, (category, chain_name, denom))
+                    # A balance that went up was refilled, so the burn rate
+                    # is measured from this sample on
+                    if amount > last_amount:
+                        anchor_timestamp, anchor_amount = timestamp, amount
+                slot = head % self.capacity
+                overwritten = connection.execute(
+                    "SELECT amount FROM balance_samples WHERE category = ? AND chain_name = ? AND denom = ? AND slot = ?",
+                    (category, chain_name, denom, slot)).fetchone()
+                if overwritten is None:
+                    samples += 1
+                else:
+                    total -= overwritten[0]
+                total += amount
+                connection.execute(
+                    "INSERT OR REPLACE INTO balance_samples VALUES (?, ?, ?, ?, ?, ?)",
+                    (category, chain_name, denom, slot, timestamp, amount))
+                connection.execute(
+                    "INSERT OR REPLACE INTO balance_series (category, chain_name, denom, head, last_timestamp, "
+                    "last_amount, anchor_timestamp, anchor_amount, total, samples, capacity) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (category, chain_name, denom, head + 1, timestamp, amount, anchor_timestamp, anchor_amount, total,
+                     samples, self.capacity))
+        return project_time_to_empty(anchor_timestamp, anchor_amount, timestamp, amount,
+                                     settings.CONFIG["balance_history"]["min_span"])
+
+    def samples(self, category: str, chain_name: str, denom: str) -> list:
+        """
+        Return the retained samples of a wallet, oldest first.
+
+        Args:
+            category (str): The category whose relayer owns the wallet.
+            chain_name (str): The chain_name of the wallet.
+            denom (str): The denom of the balance.
+
+        Returns:
+            list: (timestamp, amount) tuples.
+        """
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT timestamp, amount FROM balance_samples WHERE category = ? AND chain_name = ? AND denom = ?",
+                (category, chain_name, denom)).fetchall()
+        return sorted(rows)
+
+    def baselines(self, keys: list) -> dict:
+        """
+        Return the mean of the retained samples of some wallets, from the sums kept by append.
+
+        Args:
+            keys (list): (category, chain_name, denom) of each wallet.
+
+        Returns:
+            dict: The mean balance keyed on (category, chain_name, denom), for the wallets with samples.
+        """
+        baselines = {}
+        with self._lock:
+            connection = self._connect()
+            for key in dict.fromkeys(keys):
+                row = connection.execute(
+                    "SELECT total, samples FROM balance_series WHERE category = ? AND chain_name = ? AND denom = ?",
+                    key).fetchone()
+                if row is not None and row[1]:
+                    baselines[key] = row[0] / row[1]
+        return baselines
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+def project_time_to_empty(start_timestamp: float, start_amount: int, timestamp: float, amount: int, min_span: float) -> float:
+    """
+    Project when a balance runs out from its burn rate since the last refill.
+
+    Args:
+        start_timestamp (float): The time of the first sample after the last refill.
+        start_amount (int): The balance at that time.
+        timestamp (float): The time of the latest sample.
+        amount (int): The latest balance.
+        min_span (float): The minimum number of seconds between the two samples.
+
+    Returns:
+        float: The projected number of seconds until the balance is empty, or
+            None when the balance is not decreasing or the samples are too close.
+    """
+    elapsed = timestamp - start_timestamp
+    burned = start_amount - amount
+    if elapsed < min_span or burned <= 0:
+        return None
+    return amount / (burned / elapsed)
+
+
+BALANCE_HISTORY = BalanceHistory(settings.CONFIG["balance_history"]["path"], settings.CONFIG["balance_history"]["capacity"])
+
+
+def report_balance_trend(category: str, chain_name: str, denom: str, amount: int):
+    """
+    Record a balance in the history and warn when it is projected to run out soon.
+
+    Args:
+        category (str): The category whose relayer owns the wallet.
+        chain_name (str): The chain_name of the wallet.
+        denom (str): The denom of the balance.
+        amount (int): The balance.
+    """
+    if not BALANCE_HISTORY.path:
+        return
+    seconds = BALANCE_HISTORY.append(category, chain_name, denom, amount)
+    if seconds is None:
+        return
+    TIME_TO_EMPTY_GAUGE.set(seconds, category, chain_name, denom)
+    hours = seconds / 3600
+    message = f"Balance on chain_name: {chain_name} will run out in about {hours:.1f} hours. Balance: {amount} {denom}"
+    if hours <= settings.CONFIG["balance_history"]["time_to_empty_error_hours"]:
+        raise_alert(logging.ERROR, chain_name, f"{denom} time to empty", message, category)
+    elif hours <= settings.CONFIG["balance_history"]["time_to_empty_warn_hours"]:
+        raise_alert(logging.WARNING, chain_name, f"{denom} time to empty", message, category)
+    else:
+        logging.debug(message)
+
+
+class ExpirationCache(JSONState):
+    """
+    Persistent expiration dates per (path, client_id), stored as a JSON file.
+
+    Client expirations only move when a client is updated, so a path is not
+    queried again until one of its clients comes within the refresh horizon
+    of the warning threshold, or its entry reaches the maximum age. The client
+    lines of the last query are kept so cached paths are reported exactly
+    like queried ones.
+    """
+    description = "expiration cache"
+
+    def __init__(self, path: str, refresh_horizon_days: float, max_age_hours: float):
+        super().__init__(path)
+        self.refresh_horizon_days = refresh_horizon_days
+        self.max_age_hours = max_age_hours
+
+    def cached_output(self, path: str) -> str:
+        """
+        Return the cached 'rly q clients-expiration' client lines of a path, if still fresh.
+
+        Args:
+            path (str): The path name.
+
+        Returns:
+            str: The cached client lines, or None when the path must be queried.
+        """
+        if not self.path:
+            return None
+        now = datetime.datetime.now()
+        with self._lock:
+            entry = self._load().get(path)
+        if entry is None or not entry["clients"]:
+            return None
+        if now - datetime.datetime.fromisoformat(entry["checked_at"]) > datetime.timedelta(hours=self.max_age_hours):
+            return None
+        horizon = now + datetime.timedelta(days=settings.CONFIG["expiration_days_threshold_warning"] + self.refresh_horizon_days)
+        for client in entry["clients"].values():
+            if datetime.datetime.fromisoformat(client["expires_at"]) <= horizon:
+                return None
+        return "\n".join(client["line"] for client in entry["clients"].values())
+
+    def store(self, path: str, output: str):
+        """
+        Remember the client expirations from a 'rly q clients-expiration' query.
+
+        Args:
+            path (str): The path name.
+            output (str): The output of the query.
+        """
+        if not self.path:
+            return
+        clients = {}
+        for line in parse_expiring_clients(output):
+            try:
+                client_id, _, expiration_date = parse_client_expiration(line)
+            except ParseError:
+                # Reported by the check. A path without clients is never served
+                # from the cache, so it is queried again on the next run
+                clients = {}
+                break
+            clients[client_id] = {"expires_at": expiration_date.isoformat(), "line": line}
+        with self._lock:
+            self._load()[path] = {"checked_at": datetime.datetime.now().isoformat(), "clients": clients}
+            self._dirty = True
+
+
+def age_runs(previous: list, current: list, now: float) -> list:
+    """
+    Carry the first-seen times of the previous runs over to the pending ranges.
+
+    Both lists are sorted and do not overlap, and are walked once side by
+    side. Sequences only in the previous runs were relayed and are dropped.
+    Sequences only in the current ranges are new and were first seen now.
+
+    Args:
+        previous (list): [first, last, first_seen] runs of the previous check.
+        current (list): [first, last] ranges of the sequences pending now.
+        now (float): The time of the current check.
+
+    Returns:
+        list: [first, last, first_seen] runs of the pending sequences.
+    """
+    runs = []
+
+    def append(first: int, last: int, seen: float):
+        if runs and runs[-1][1] + 1 == first and runs[-1][2] == seen:
+            runs[-1][1] = last
+        else:
+            runs.append([first, last, seen])
+
+    index = 0
+    for first, last in current:
+        while index < len(previous) and previous[index][1] < first:
+            index += 1
+        position = first
+        while position <= last:
+            if index < len(previous) and previous[index][0] <= last:
+                run_first, run_last, seen = previous[index]
+                if run_first > position:
+                    append(position, run_first - 1, now)
+                    position = run_first
+                end = min(run_last, last)
+                append(position, end, seen)
+                position = end + 1
+                if run_last > last:
+                    # The run continues into the next range
+                    break
+                index += 1
+            else:
+                append(position, last, now)
+                position = last + 1
+    return runs
+
+
+def merge_ranges(ranges: list) -> list:
+    """Sort [first, last] ranges and merge those that overlap or touch."""
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+    return merged
+
+
+class PacketAges(JSONState):
+    """
+    The pending packet sequences of each path, channel and direction, with the
+    time each was first seen, stored as a JSON file.
+
+    Sequences are kept as runs of consecutive sequences first seen together,
+    so a backlog of thousands of packets takes a few runs rather than an
+    entry per sequence. Without a path the ages are only kept in memory.
+    """
+    description = "packet ages"
+    separators = (",", ":")
+
+    def update(self, key: str, ranges: list, now: float = None) -> list:
+        """
+        Replace the pending sequences of a key, keeping when each was first seen.
+
+        Args:
+            key (str): The path, channel and direction.
+            ranges (list): [first, last] ranges of the sequences pending now.
+            now (float): The time of the check, defaults to now.
+
+        Returns:
+            list: [first, last, first_seen] runs of the pending sequences.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            entries = self._load()
+            runs = age_runs(entries.get(key, []), merge_ranges(ranges), now)
+            if runs:
+                entries[key] = runs
+            else:
+                entries.pop(key, None)
+            self._dirty = True
+        return runs
+
+
+def stuck_packets(runs: list, now: float, stuck_after: float) -> tuple:
+    """
+    Count the sequences pending for at least stuck_after seconds.
+
+    Args:
+        runs (list): [first, last, first_seen] runs from PacketAges.update.
+        now (float): The time of the check.
+        stuck_after (float): The age in seconds from which a packet is stuck.
+
+    Returns:
+        tuple: The number of stuck sequences and the age of the oldest one in
+            seconds, None without pending sequences.
+    """
+    stuck = sum(last - first + 1 for first, last, seen in runs if now - seen >= stuck_after)
+    oldest = min((seen for _, _, seen in runs), default=None)
+    return stuck, None if oldest is None else now - oldest
+
+
+PACKET_AGES = PacketAges(settings.CONFIG["packet_ages"]["path"])
+
+EXPIRATION_CACHE = ExpirationCache(settings.CONFIG["expiration_cache"]["path"],
+                                   settings.CONFIG["expiration_cache"]["refresh_horizon_days"],
+                                   settings.CONFIG["expiration_cache"]["max_age_hours"])
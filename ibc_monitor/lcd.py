@@ -0,0 +1,213 @@
+"""Balance queries against the chains' LCD endpoints."""
+import json
+import queue
+import threading
+import urllib.parse
+
+from . import settings
+from .parsers import ParseError, parse_balance
+
+
+class HTTPError(OSError):
+    """A request that failed, or was answered with a status outside 2xx."""
+
+
+class HTTPConnectionPool:
+    """
+    Keep-alive HTTP connections to a single host, reused across requests.
+
+    A connection that fails is closed and dropped instead of being returned
+    to the pool. A reused connection the server closed while it was idle is
+    replaced by a new one and the request sent once more. http.client is
+    only imported once a request is made.
+    """
+
+    def __init__(self, scheme: str, host: str, timeout: float, size: int):
+        self.scheme = scheme
+        self.host = host
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _connect(self):
+        import http.client
+        if self.scheme == "https":
+            return http.client.HTTPSConnection(self.host, timeout=self.timeout)
+        return http.client.HTTPConnection(self.host, timeout=self.timeout)
+
+    def request(self, method: str, url: str, body: dict = None) -> bytes:
+        """
+        Send a request, with an optional JSON body, and return the response body.
+
+        Args:
+            method (str): The HTTP method.
+            url (str): The path and query string of the request.
+            body (dict): Sent as JSON if given.
+
+        Returns:
+            bytes: The response body.
+
+        Raises:
+            OSError: The request failed, HTTPError if it was answered with an error status.
+        """
+        import http.client
+        headers = {"Accept": "application/json"}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+        try:
+            connection, reused = self._idle.get_nowait(), True
+        except queue.Empty:
+            connection, reused = self._connect(), False
+        try:
+            try:
+                response, data = self._exchange(connection, method, url, payload, headers)
+            except (ConnectionError, http.client.BadStatusLine):
+                if not reused:
+                    raise
+                # The server closed the connection while it was idle
+                connection = self._connect()
+                response, data = self._exchange(connection, method, url, payload, headers)
+        except http.client.HTTPException as e:
+            raise HTTPError(f"{method} {url} failed: {e!r}") from e
+        if response.will_close:
+            connection.close()
+        else:
+            try:
+                self._idle.put_nowait(connection)
+            except queue.Full:
+                connection.close()
+        if not 200 <= response.status < 300:
+            raise HTTPError(f"{method} {url} returned HTTP {response.status}")
+        return data
+
+    @staticmethod
+    def _exchange(connection, method: str, url: str, payload: bytes, headers: dict) -> tuple:
+        """Send a request on a connection and read the response, closing the connection if that fails."""
+        try:
+            connection.request(method, url, body=payload, headers=headers)
+            response = connection.getresponse()
+            return response, response.read()
+        except BaseException:
+            connection.close()
+            raise
+
+    def get_json(self, url: str) -> dict:
+        """
+        Send a GET request and decode the JSON response.
+
+        Args:
+            url (str): The path and query string of the request.
+
+        Returns:
+            dict: The decoded response body.
+        """
+        return json.loads(self.request("GET", url))
+
+
+class LCDBalanceBackend:
+    """
+    Answer 'rly q balance' queries from the chains' Cosmos LCD endpoints.
+
+    Each relayer deployment has its own wallet on a chain, so addresses are
+    kept per (namespace, relayer, chain_name). The address is taken from
+    lcd_accounts, or learned from the first 'rly q balance' output of the
+    deployment for the chain, in which case that first query still goes
+    through the relayer. Balances are returned in the output format of
+    'rly q balance', with IBC denoms resolved to their denom trace, so they
+    can be handed to parse_balance unchanged.
+    """
+
+    def __init__(self, endpoints: dict, timeout: float, pool_size: int, configured_accounts: dict = None):
+        self.endpoints = endpoints
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.enabled = False
+        self.configured_accounts = configured_accounts or {}
+        self.accounts = {}
+        self._denom_traces = {}
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def can_query(self, namespace: str, relayer: str, args: tuple) -> bool:
+        """Whether the rly query with these arguments, for a relayer deployment, can be answered by the backend."""
+        if not self.enabled or len(args) != 3 or args[:2] != ('q', 'balance'):
+            return False
+        return args[2] in self.endpoints and self._account(namespace, relayer, args[2]) is not None
+
+    def learn(self, namespace: str, relayer: str, args: tuple, output: str):
+        """Remember the wallet address found in the output of a deployment's 'rly q balance' query."""
+        if len(args) == 3 and args[:2] == ('q', 'balance') and output:
+            try:
+                self.accounts[(namespace, relayer, args[2])] = parse_balance(output)["account"]
+            except ParseError:
+                pass
+
+    def _account(self, namespace: str, relayer: str, chain_name: str) -> str:
+        key = (namespace, relayer, chain_name)
+        return self.configured_accounts.get(key) or self.accounts.get(key)
+
+    def _pool(self, chain_name: str) -> tuple:
+        endpoint = urllib.parse.urlsplit(self.endpoints[chain_name])
+        key = (endpoint.scheme, endpoint.netloc)
+        with self._lock:
+            if key not in self._pools:
+                self._pools[key] = HTTPConnectionPool(endpoint.scheme, endpoint.netloc,
+                                                      self.timeout, self.pool_size)
+            return self._pools[key], endpoint.path.rstrip("/")
+
+    def _denom(self, pool: HTTPConnectionPool, prefix: str, denom: str) -> str:
+        if not denom.startswith("ibc/"):
+            return denom
+        if denom not in self._denom_traces:
+            trace = pool.get_json(f"{prefix}/ibc/apps/transfer/v1/denom_traces/{denom[4:]}")["denom_trace"]
+            self._denom_traces[denom] = f"{trace['path']}/{trace['base_denom']}" if trace["path"] else trace["base_denom"]
+        return self._denom_traces[denom]
+
+    def query(self, namespace: str, relayer: str, args: tuple) -> str:
+        """
+        Query the balance of a relayer deployment's wallet from the LCD endpoint of the chain.
+
+        Args:
+            namespace (str): The namespace in which the relayer is deployed.
+            relayer (str): The name of the relayer.
+            args (tuple): The arguments of the 'rly q balance' query.
+
+        Returns:
+            str: The balance in the output format of 'rly q balance'.
+        """
+        chain_name = args[2]
+        account = self._account(namespace, relayer, chain_name)
+        pool, prefix = self._pool(chain_name)
+        coins = []
+        page_key = None
+        while True:
+            url = f"{prefix}/cosmos/bank/v1beta1/balances/{account}"
+            if page_key:
+                url += "?" + urllib.parse.urlencode({"pagination.key": page_key})
+            data = pool.get_json(url)
+            for coin in data["balances"]:
+                coins.append(f"{coin['amount']}{self._denom(pool, prefix, coin['denom'])}")
+            page_key = (data.get("pagination") or {}).get("next_key")
+            if not page_key:
+                break
+        return f"address {{{account}}} balance {{{','.join(coins)}}}"
+
+
+def deployment_accounts(config: dict) -> dict:
+    """
+    Key the wallet addresses of lcd_accounts on the relayer deployment of their category.
+
+    Args:
+        config (dict): The complete configuration.
+
+    Returns:
+        dict: The address keyed on (namespace, relayer, chain_name).
+    """
+    return {(config["namespaces"].get(category), config["relayers"].get(category), chain_name): account
+            for category, accounts in config["lcd_accounts"].items()
+            for chain_name, account in accounts.items()}
+
+
+LCD_BACKEND = LCDBalanceBackend(settings.CONFIG["lcd_endpoints"], settings.CONFIG["lcd_timeout"],
+                                settings.CONFIG["lcd_pool_size"], deployment_accounts(settings.CONFIG))
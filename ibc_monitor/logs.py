@@ -0,0 +1,160 @@
+"""Log output, queued and written in batches by a single listener thread."""
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+from colorama import Fore, Style, init
+
+
+# Define a custom ANSI escape sequence for orange color
+ORANGE = "\033[38;5;208m"  # ANSI escape sequence for orange color
+RESET = Style.RESET_ALL
+
+
+class TextFormatter(logging.Formatter):
+    """Format records as "LEVEL: message", with the level colored on a terminal."""
+
+    COLORS = {
+        logging.DEBUG: Fore.YELLOW,
+        logging.INFO: Fore.GREEN,
+        logging.WARNING: ORANGE,
+        logging.ERROR: Fore.RED,
+        logging.CRITICAL: Fore.RED,
+    }
+
+    def __init__(self, color: bool):
+        super().__init__()
+        self.prefixes = {level: f"{color_code}{logging.getLevelName(level)}{RESET}: " if color
+                         else f"{logging.getLevelName(level)}: "
+                         for level, color_code in self.COLORS.items()}
+
+    def format(self, record):
+        prefix = self.prefixes.get(record.levelno) or f"{record.levelname}: "
+        return prefix + super().format(record)
+
+
+class JSONFormatter(logging.Formatter):
+    """Format records as one JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "message": super().format(record),
+        }
+        return json.dumps(entry)
+
+
+class LogfmtFormatter(logging.Formatter):
+    """Format records as logfmt key=value pairs."""
+
+    def format(self, record):
+        message = super().format(record).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        time_stamp = datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat()
+        return f'time={time_stamp} level={record.levelname.lower()} msg="{message}"'
+
+
+class BufferedStreamHandler(logging.Handler):
+    """Collect formatted records and write them to the stream in one call per flush."""
+
+    def __init__(self, stream, capacity: int = 1024):
+        super().__init__()
+        self.stream = stream
+        self.capacity = capacity
+        self.buffer = []
+
+    def emit(self, record):
+        try:
+            self.buffer.append(self.format(record))
+        except Exception:
+            self.handleError(record)
+        if len(self.buffer) >= self.capacity:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        lines, self.buffer = self.buffer, []
+        self.stream.write("\n".join(lines) + "\n")
+        self.stream.flush()
+
+
+class BatchingQueueListener(logging.handlers.QueueListener):
+    """Flush the handlers whenever the queue runs empty, so a burst of records is written at once."""
+
+    def handle(self, record):
+        super().handle(record)
+        if self.queue.empty():
+            for handler in self.handlers:
+                handler.flush()
+
+
+LOG_FORMATS = {
+    "text": TextFormatter,
+    "json": JSONFormatter,
+    "logfmt": LogfmtFormatter,
+}
+
+
+class LogPipeline:
+    """
+    Route every log record through a queue to a single buffered output handler.
+
+    Logging from a check then costs a queue put; formatting and writing happen on
+    the listener thread. The root logger is left with exactly one handler, the
+    queue, however often the pipeline is started.
+    """
+
+    def __init__(self):
+        self.queue = queue.SimpleQueue()
+        self.listener = None
+        self.handler = None
+        self.log_format = None
+        self._initialized = False
+
+    def start(self, log_format: str, stream=None):
+        """
+        Start writing records to the stream, replacing any previous output.
+
+        Args:
+            log_format (str): "text", "json" or "logfmt".
+            stream: Where to write, stdout by default. Text is colored only if it is a terminal.
+        """
+        self.stop()
+        if not self._initialized:
+            # Translates the color codes on Windows terminals
+            init()
+            atexit.register(self.stop)
+            self._initialized = True
+        stream = stream or sys.stdout
+        if log_format == "text":
+            color = stream.isatty() and "NO_COLOR" not in os.environ
+            formatter = TextFormatter(color)
+        else:
+            formatter = LOG_FORMATS[log_format]()
+        self.handler = BufferedStreamHandler(stream)
+        self.handler.setFormatter(formatter)
+        self.listener = BatchingQueueListener(self.queue, self.handler)
+        self.listener.start()
+        self.log_format = log_format
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(logging.handlers.QueueHandler(self.queue))
+
+    def stop(self):
+        """Write the queued records and stop the listener thread."""
+        if self.listener is None:
+            return
+        self.listener.stop()
+        self.handler.flush()
+        self.listener = None
+
+
+LOG_PIPELINE = LogPipeline()
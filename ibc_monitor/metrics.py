@@ -0,0 +1,124 @@
+"""Prometheus metrics and the endpoint serving them."""
+import logging
+import threading
+
+
+def _format_labels(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    pairs = []
+    for name, value in zip(labelnames, values):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Gauge:
+    """A labelled Prometheus gauge."""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, *labels: str):
+        with self._lock:
+            self._values[labels] = value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for labels, value in self._values.items():
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    """A labelled Prometheus histogram with fixed buckets."""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple, buckets: tuple):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        with self._lock:
+            # Per-bucket counts followed by the sum and the count of observations
+            series = self._series.setdefault(labels, [0] * len(self.buckets) + [0.0, 0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, series in self._series.items():
+                for bound, count in zip(self.buckets + ("+Inf",), series[:-2] + series[-1:]):
+                    bucket_labels = _format_labels(self.labelnames, labels, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {series[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {series[-1]}")
+        return lines
+
+
+BALANCE_GAUGE = Gauge("wallet_balance", "Wallet balance reported by rly q balance.",
+                      ("category", "chain_name", "denom"))
+CLIENT_EXPIRY_GAUGE = Gauge("ibc_client_expiry_seconds", "Seconds until the IBC client expires.",
+                            ("client_id", "chain_id"))
+UNRELAYED_PACKETS_GAUGE = Gauge("ibc_unrelayed_packets", "Whether the channel has unrelayed packets.",
+                                ("chain_name", "channel"))
+UNRELAYED_PACKET_AGE_GAUGE = Gauge("ibc_unrelayed_packet_age_seconds",
+                                   "Seconds since the oldest pending packet of the channel was first seen.",
+                                   ("chain_name", "channel"))
+QUERY_DURATION_HISTOGRAM = Histogram("rly_query_duration_seconds", "Time taken by kubectl and rly subprocesses.",
+                                     ("subcommand", "namespace", "relayer"),
+                                     (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+TIME_TO_EMPTY_GAUGE = Gauge("wallet_balance_seconds_to_empty", "Projected seconds until the balance runs out.",
+                            ("category", "chain_name", "denom"))
+CIRCUIT_OPEN_GAUGE = Gauge("relayer_circuit_open", "Whether queries to the relayer are suspended after repeated failures.",
+                           ("namespace", "relayer"))
+METRICS = [BALANCE_GAUGE, TIME_TO_EMPTY_GAUGE, CLIENT_EXPIRY_GAUGE, UNRELAYED_PACKETS_GAUGE,
+           UNRELAYED_PACKET_AGE_GAUGE, QUERY_DURATION_HISTOGRAM, CIRCUIT_OPEN_GAUGE]
+
+
+def start_metrics_server(port: int):
+    """
+    Serve the metrics endpoint from a background thread.
+
+    Args:
+        port (int): The port to listen on.
+
+    Returns:
+        http.server.ThreadingHTTPServer: The running server.
+    """
+    # Only imported when metrics are served
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        """Serve the collected metrics on /metrics."""
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = ("\n".join(line for metric in METRICS for line in metric.render()) + "\n").encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logging.debug(f"Metrics request: {format % args}")
+
+    server = ThreadingHTTPServer(("", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logging.info(f"Serving metrics on port {port}")
+    return server
@@ -0,0 +1,299 @@
+"""
+Parsers for the output of rly queries.
+
+Outputs that rly prints as JSON are decoded as JSON. The text formats are
+read by compiled tokenizers in a single pass. Output without the expected
+shape raises ParseError instead of being skipped, so a change in the output
+of rly shows up as an error rather than as missing alerts.
+"""
+import datetime
+import json
+import logging
+import re
+
+from .profiling import PROFILER
+
+
+class ParseError(ValueError):
+    """Raised when the output of an rly query does not have the expected format."""
+
+
+def _excerpt(output: str) -> str:
+    return repr(output[:80] + ("..." if len(output) > 80 else ""))
+
+
+def _load_json(output: str, query: str) -> dict:
+    try:
+        data = json.loads(output)
+    except ValueError as e:
+        raise ParseError(f"'rly {query}' did not print JSON ({e}): {_excerpt(output)}")
+    if not isinstance(data, dict):
+        raise ParseError(f"'rly {query}' did not print a JSON object: {_excerpt(output)}")
+    return data
+
+
+# The name of each JSON type, for error messages
+JSON_TYPES = {dict: "object", list: "array", str: "string"}
+
+
+def _json_field(data: dict, key: str, kind: type, query: str, where: str):
+    # A missing or null field is empty, one of another type is unexpected output
+    value = data.get(key)
+    if value is None:
+        return kind()
+    if not isinstance(value, kind):
+        raise ParseError(f"'rly {query}' printed {where}.{key} that is not a JSON {JSON_TYPES[kind]}: "
+                         f"{_excerpt(json.dumps(value))}")
+    return value
+
+
+@PROFILER.profiled("parse")
+def parse_expiring_clients(output: str) -> list:
+    """
+    Parse the output of the 'rly q clients-expiration' command and extract expiring clients.
+
+    Args:
+        output (str): The output of the 'rly q clients-expiration' command.
+
+    Returns:
+        list: A list of expiring clients.
+    """
+    return CLIENT_LINES.findall(output)
+
+
+CLIENT_LINES = re.compile(r"^client.*$", re.MULTILINE)
+# client 07-tendermint-1 (kaiyo-1) expires in 3d1h (05 Nov 26 14:32 UTC)
+CLIENT_EXPIRATION = re.compile(
+    r"client\s+(?P<client>\S+)\s+\((?P<chain>[^()\s]+)\)"
+    r".*?\b(?P<day>\d{1,2}) (?P<month>Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec) (?P<year>\d{4}|\d{2})\b")
+MONTHS = {month: number for number, month in enumerate(
+    ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"), 1)}
+
+
+@PROFILER.profiled("parse")
+def parse_client_expiration(client: str) -> tuple:
+    """
+    Extract the client ID, chain ID and expiration date from a client expiration line.
+
+    The date is read as day, abbreviated month and a two or four digit year,
+    at midnight, without strptime.
+
+    Args:
+        client (str): The client expiration line.
+
+    Returns:
+        tuple: The client ID, the chain ID and the expiration date.
+
+    Raises:
+        ParseError: The line has no client, chain or valid expiration date.
+    """
+    match = CLIENT_EXPIRATION.match(client)
+    if match is None:
+        raise ParseError(f"expected 'client <id> (<chain-id>) ... <dd Mon yy>', got: {_excerpt(client)}")
+    year = int(match["year"])
+    if len(match["year"]) == 2:
+        # The pivot of strptime's %y
+        year += 1900 if year >= 69 else 2000
+    try:
+        expiration_date = datetime.datetime(year, MONTHS[match["month"]], int(match["day"]))
+    except ValueError as e:
+        raise ParseError(f"invalid expiration date ({e}): {_excerpt(client)}")
+    return match["client"], match["chain"], expiration_date
+
+
+class PacketSummary:
+    """The count, bounds and contiguous ranges of the pending sequences of one direction."""
+    __slots__ = ("present", "count", "min", "max", "ranges")
+
+    def __init__(self):
+        self.present = False
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.ranges = []
+
+    def add(self, sequence: int):
+        self.count += 1
+        if self.min is None or sequence < self.min:
+            self.min = sequence
+        if self.max is None or sequence > self.max:
+            self.max = sequence
+        if self.ranges and self.ranges[-1][1] + 1 == sequence:
+            self.ranges[-1][1] = sequence
+        else:
+            self.ranges.append([sequence, sequence])
+
+    def __str__(self) -> str:
+        if not self.present:
+            return "none"
+        if not self.count:
+            return "0 packets"
+        shown = ", ".join(f"{start}" if start == end else f"{start}-{end}"
+                          for start, end in self.ranges[:UNRELAYED_RANGES_SHOWN])
+        if len(self.ranges) > UNRELAYED_RANGES_SHOWN:
+            shown += f", ... ({len(self.ranges) - UNRELAYED_RANGES_SHOWN} more ranges)"
+        return f"{self.count} packets, sequences {self.min}-{self.max} ({shown})"
+
+
+UNRELAYED_RANGES_SHOWN = 10
+UNRELAYED_TOKEN = re.compile(r'"(src|dst)"|(\d+)|(\])')
+
+
+@PROFILER.profiled("parse")
+def summarize_unrelayed_packets(output: str) -> dict:
+    """
+    Summarize the output of 'rly q unrelayed-packets' in a single pass.
+
+    The sequence arrays are scanned token by token instead of being decoded,
+    so a backlogged channel with thousands of pending packets costs a few
+    counters and its contiguous ranges rather than full lists.
+
+    Args:
+        output (str): The output of the 'rly q unrelayed-packets' command.
+
+    Returns:
+        dict: A PacketSummary for "src" and for "dst".
+
+    Raises:
+        ParseError: The output has neither a src nor a dst key.
+    """
+    summaries = {"src": PacketSummary(), "dst": PacketSummary()}
+    current = None
+    seen = False
+    for match in UNRELAYED_TOKEN.finditer(output):
+        direction, sequence, end = match.groups()
+        if direction:
+            # The key is followed by either null or an array
+            seen = True
+            current = summaries[direction]
+            current.present = output[match.end():match.end() + 16].lstrip(" \t\r\n:").startswith("[")
+            if not current.present:
+                current = None
+        elif sequence and current is not None:
+            current.add(int(sequence))
+        elif end:
+            current = None
+    if not seen:
+        raise ParseError(f"'rly q unrelayed-packets' printed neither src nor dst: {_excerpt(output)}")
+    return summaries
+
+
+def unrelayed_sequences(output: str, direction: str):
+    """
+    Yield every pending sequence of one direction of 'rly q unrelayed-packets'.
+
+    Args:
+        output (str): The output of the 'rly q unrelayed-packets' command.
+        direction (str): "src" or "dst".
+
+    Yields:
+        int: The pending sequences, in the order rly lists them.
+    """
+    current = False
+    for match in UNRELAYED_TOKEN.finditer(output):
+        key, sequence, end = match.groups()
+        if key:
+            current = key == direction
+        elif sequence and current:
+            yield int(sequence)
+        elif end:
+            current = False
+
+
+# address {kujira1...} balance {100000ukuji,10000transfer/channel-1/uatom}
+BALANCE_TEXT = re.compile(r"address\s*\{(?P<account>[^{}]*)\}\s*balance\s*\{(?P<coins>[^{}]*)\}")
+# Only at the start of a coin, so a denom containing digits is never split
+COIN = re.compile(r"(?:^|,)\s*(\d+)([^,]*)")
+
+
+@PROFILER.profiled("parse")
+def parse_balance(output: str):
+    """
+    Parse the output of the 'rly q balance' command and extract the account and balances.
+
+    Both the text output and the output of 'rly q balance --output json' are read.
+
+    Args:
+        output (str): The output of the 'rly q balance' command.
+
+    Returns:
+        dict: An object with the account and a list of balances.
+
+    Raises:
+        ParseError: The output has neither format.
+    """
+    if output.lstrip().startswith("{"):
+        data = _load_json(output, "q balance")
+        account, coins = data.get("address"), data.get("balance")
+        if not isinstance(account, str):
+            raise ParseError(f"'rly q balance' printed no address: {_excerpt(output)}")
+        if isinstance(coins, list):
+            try:
+                return {"account": account,
+                        "balances": [{"amount": int(coin["amount"]), "denom": coin["denom"]} for coin in coins]}
+            except (KeyError, TypeError, ValueError):
+                raise ParseError(f"'rly q balance' printed invalid coins: {_excerpt(output)}")
+        if not isinstance(coins, str):
+            raise ParseError(f"'rly q balance' printed no balance: {_excerpt(output)}")
+    else:
+        match = BALANCE_TEXT.search(output)
+        if match is None:
+            raise ParseError(f"expected 'address {{...}} balance {{...}}', got: {_excerpt(output)}")
+        account, coins = match["account"].strip(), match["coins"]
+    balances = [{"amount": int(amount), "denom": denom.strip()} for amount, denom in COIN.findall(coins)]
+    return {"account": account, "balances": balances}
+
+
+@PROFILER.profiled("parse")
+def parse_chain_names(output: str) -> dict:
+    """
+    Parse the output of the 'rly chains list --json' command.
+
+    Args:
+        output (str): The output of the 'rly chains list --json' command.
+
+    Returns:
+        dict: The rly chain name of each chain ID.
+    """
+    chain_names = {}
+    query = "chains list --json"
+    for name, chain in _load_json(output, query).items():
+        if not isinstance(chain, dict):
+            raise ParseError(f"'rly {query}' printed chain {name} that is not a JSON object")
+        chain_id = _json_field(_json_field(chain, "value", dict, query, name), "chain-id", str, query, f"{name}.value")
+        if chain_id:
+            chain_names[chain_id] = name
+    return chain_names
+
+
+@PROFILER.profiled("parse")
+def parse_discovered_paths(category: str, output: str, chain_names: dict) -> dict:
+    """
+    Parse the output of the 'rly paths list --json' command into path entries.
+
+    Only paths from the category's own chain, with a channel allowlist of a
+    single channel, can be monitored: the channel filter names the channel on
+    the source chain.
+
+    Args:
+        category (str): The category, which is also the rly name of its own chain.
+        output (str): The output of the 'rly paths list --json' command.
+        chain_names (dict): The rly chain name of each chain ID, from parse_chain_names.
+
+    Returns:
+        dict: Path entries with a chain_name and channel, keyed on the path name.
+    """
+    paths = {}
+    query = "paths list --json"
+    for name, path in _load_json(output, query).items():
+        if not isinstance(path, dict):
+            raise ParseError(f"'rly {query}' printed path {name} that is not a JSON object")
+        src = chain_names.get(_json_field(_json_field(path, "src", dict, query, name), "chain-id", str, query, f"{name}.src"))
+        dst = chain_names.get(_json_field(_json_field(path, "dst", dict, query, name), "chain-id", str, query, f"{name}.dst"))
+        channel_filter = _json_field(path, "src-channel-filter", dict, query, name)
+        channels = _json_field(channel_filter, "channel-list", list, query, f"{name}.src-channel-filter")
+        if src != category or dst is None or channel_filter.get("rule") != "allowlist" or len(channels) != 1:
+            logging.debug(f"Not monitoring discovered path {name}: no single allowed channel from {category}")
+            continue
+        paths[name] = {"chain_name": dst, "channel": channels[0]}
+    return paths
@@ -0,0 +1,115 @@
+"""Timing of each stage of a run."""
+import contextlib
+import contextvars
+import functools
+import threading
+import time
+
+
+class Profiler:
+    """
+    Time each stage of a run: discovery, subprocesses, parsers and threshold evaluation.
+
+    Timings are attributed to the category and path of the check being run,
+    which the executor sets with context() on whichever thread handles it.
+    Stages may nest, e.g. evaluating client expirations includes parsing
+    their dates. Nothing is recorded while the profiler is disabled.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.records = []
+        self._lock = threading.Lock()
+        self._context = contextvars.ContextVar("profile_context", default=("", ""))
+
+    def enable(self):
+        """Start recording timings, discarding any recorded before."""
+        with self._lock:
+            self.records = []
+        self.enabled = True
+
+    @contextlib.contextmanager
+    def context(self, category: str, path: str):
+        """Attribute the timings recorded inside the block to a category and path."""
+        token = self._context.set((category, path))
+        try:
+            yield
+        finally:
+            self._context.reset(token)
+
+    def record(self, stage: str, label: str, seconds: float, spawn: float = None):
+        """
+        Record the duration of a stage.
+
+        Args:
+            stage (str): The stage, e.g. "query" or "parse".
+            label (str): What was timed, e.g. the command or the parser name.
+            seconds (float): The wall time of the stage.
+            spawn (float): For subprocesses, the time taken to start the process.
+        """
+        category, path = self._context.get()
+        with self._lock:
+            self.records.append((stage, label, category, path, seconds, spawn))
+
+    @contextlib.contextmanager
+    def span(self, stage: str, label: str):
+        """Record the duration of the block as a stage."""
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, label, time.perf_counter() - started)
+
+    def profiled(self, stage: str):
+        """Decorate a function so that each call is recorded as a stage."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with self.span(stage, func.__name__):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def report(self, top: int = 10) -> str:
+        """
+        Summarize the recorded timings.
+
+        Args:
+            top (int): The number of slowest calls to list.
+
+        Returns:
+            str: A breakdown per stage, per category and path, and the slowest calls.
+        """
+        with self._lock:
+            records = list(self.records)
+        stages = {}
+        paths = {}
+        for stage, label, category, path, seconds, spawn in records:
+            calls, total, spawn_total = stages.get(stage, (0, 0.0, 0.0))
+            stages[stage] = (calls + 1, total + seconds, spawn_total + (spawn or 0.0))
+            if category or path:
+                row = paths.setdefault((category, path), {})
+                row[stage] = row.get(stage, 0.0) + seconds
+
+        lines = ["Stage                 calls     total     spawn"]
+        for stage, (calls, total, spawn_total) in stages.items():
+            lines.append(f"{stage:<20} {calls:>6} {total:>8.3f}s {spawn_total:>8.3f}s")
+
+        columns = [stage for stage in stages if any(stage in row for row in paths.values())]
+        lines += ["", f"{'Category':<12} {'Path':<36} " + " ".join(f"{stage:>10}" for stage in columns)]
+        for (category, path), row in paths.items():
+            lines.append(f"{category:<12} {path:<36} " + " ".join(f"{row.get(stage, 0.0):>9.3f}s" for stage in columns))
+
+        lines += ["", f"Slowest {top} calls:"]
+        for stage, label, category, path, seconds, spawn in sorted(records, key=lambda r: r[4], reverse=True)[:top]:
+            spawned = f" (spawn {spawn:.3f}s)" if spawn is not None else ""
+            lines.append(f"{seconds:>8.3f}s{spawned} {stage} {category} {path} {label}")
+        return "\n".join(lines)
+
+
+PROFILER = Profiler()
@@ -0,0 +1,771 @@
+"""Running rly queries: commands, caching, batching and the check executor."""
+import contextlib
+import hashlib
+import logging
+import os
+import random
+import re
+import secrets
+import shlex
+import signal
+import subprocess
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, NamedTuple
+
+from . import settings
+from .cassette import CASSETTE
+from .lcd import LCD_BACKEND
+from .metrics import CIRCUIT_OPEN_GAUGE, QUERY_DURATION_HISTOGRAM
+from .parsers import ParseError
+from .profiling import PROFILER
+
+
+class QueryFailed(Exception):
+    """A query that timed out, failed, or was not run because its target is failing."""
+
+
+def run_subprocess_command(command: list, timeout: float = None, stdin: str = None) -> str:
+    """
+    Run a subprocess command and return the output as a string.
+
+    The command runs in its own process group, which is killed as a whole
+    when the timeout expires, so no kubectl or rly child is left behind.
+    While a cassette is recorded, its output or failure is added to it. While
+    one is replayed, the recorded result is returned without running anything.
+
+    Args:
+        command (list): The command to be executed as a list of strings.
+        timeout (float): Seconds after which the command is killed, or None to wait indefinitely.
+        stdin (str): Written to the standard input of the command, if given.
+
+    Returns:
+        str: The output of the subprocess command as a string.
+
+    Raises:
+        QueryFailed: The command timed out, exited with an error or could not be started.
+    """
+    if CASSETTE.mode == "replay":
+        return replay_command(command, stdin)
+    if CASSETTE.mode == "record":
+        started = time.monotonic()
+        try:
+            output = spawn_command(command, timeout, stdin)
+        except QueryFailed as e:
+            CASSETTE.add(cassette_key(command, stdin), str(e), started, time.monotonic() - started, failed=True)
+            raise
+        CASSETTE.add(cassette_key(command, stdin), output, started, time.monotonic() - started)
+        return output
+    return spawn_command(command, timeout, stdin)
+
+
+def spawn_command(command: list, timeout: float = None, stdin: str = None) -> str:
+    """Run a subprocess command in its own process group, see run_subprocess_command."""
+    started = time.perf_counter()
+    spawned = None
+    try:
+        with subprocess.Popen(command, stdin=subprocess.PIPE if stdin is not None else None,
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                              start_new_session=True) as process:
+            spawned = time.perf_counter()
+            try:
+                stdout, stderr = process.communicate(stdin, timeout=timeout)
+            except subprocess.TimeoutExpired:
+                with contextlib.suppress(ProcessLookupError):
+                    os.killpg(process.pid, signal.SIGKILL)
+                process.communicate()
+                raise QueryFailed(f"timed out after {timeout}s")
+    except (OSError, subprocess.SubprocessError) as e:
+        raise QueryFailed(f"could not run {command[0]}: {e}") from e
+    finally:
+        if PROFILER.enabled:
+            label = ' '.join(command[command.index('rly'):] if 'rly' in command else command)
+            PROFILER.record("query", label, time.perf_counter() - started,
+                            spawned - started if spawned is not None else None)
+    if process.returncode != 0:
+        error = stderr.strip().splitlines()[-1] if stderr.strip() else "no error output"
+        raise QueryFailed(f"exited with status {process.returncode}: {error}")
+    return stdout.strip()
+
+
+def cassette_key(command: list, stdin: str = None) -> str:
+    """
+    Identify a command, and the input written to it, in a cassette.
+
+    The kube context and kubeconfig are left out, so a cassette recorded in
+    production can be replayed with another kubeconfig.
+    """
+    key = []
+    arguments = iter(command)
+    for argument in arguments:
+        if argument in ('--context', '--kubeconfig'):
+            next(arguments, None)
+        else:
+            key.append(argument)
+    if stdin is not None:
+        key.append(stdin)
+    return '\0'.join(key)
+
+
+def replay_command(command: list, stdin: str = None) -> str:
+    """Return the recorded result of a command, raising QueryFailed for a recorded failure."""
+    started = time.perf_counter()
+    try:
+        output, failed = CASSETTE.play(cassette_key(command, stdin))
+    except KeyError:
+        raise QueryFailed("was not recorded in the cassette")
+    finally:
+        if PROFILER.enabled:
+            label = ' '.join(command[command.index('rly'):] if 'rly' in command else command)
+            PROFILER.record("query", label, time.perf_counter() - started)
+    if failed:
+        raise QueryFailed(output)
+    return output
+
+
+def timed_subprocess_command(command: list, subcommand: str, namespace: str, relayer: str,
+                             timeout: float = None, stdin: str = None) -> str:
+    """
+    Run a subprocess command and record how long it took.
+
+    Args:
+        command (list): The command to be executed as a list of strings.
+        subcommand (str): The rly subcommand being run, used as a metric label.
+        namespace (str): The namespace in which the relayer is deployed, or None for local commands.
+        relayer (str): The name of the relayer, or None for local commands.
+        timeout (float): Seconds after which the command is killed, or None to wait indefinitely.
+        stdin (str): Written to the standard input of the command, if given.
+
+    Returns:
+        str: The output of the subprocess command as a string.
+    """
+    started = time.monotonic()
+    try:
+        return run_subprocess_command(command, timeout, stdin)
+    finally:
+        QUERY_DURATION_HISTOGRAM.observe(time.monotonic() - started, subcommand,
+                                         namespace or "", relayer or "local")
+
+
+class CircuitBreaker:
+    """
+    Stop querying a relayer deployment that keeps failing, then probe it again.
+
+    After failure_threshold queries in a row have failed, the breaker opens
+    and queries fail at once without a subprocess. Once reset_timeout seconds
+    have passed a single query is let through as a probe, with no retries:
+    if it succeeds the breaker closes, if it fails the breaker stays open for
+    another reset_timeout.
+    """
+
+    def __init__(self, name: tuple, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        # The thread running the probe of the open breaker, if any
+        self._prober = None
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Tell whether a query may run now, making the calling thread the prober of an open breaker."""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self._prober is not None or time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self._prober = threading.get_ident()
+            return True
+
+    def probing(self) -> bool:
+        """Tell whether the calling thread runs the probe of the open breaker."""
+        with self._lock:
+            return self._prober == threading.get_ident()
+
+    def abandon_probe(self):
+        """Let another query probe the target when the calling thread's probe ended without a result."""
+        with self._lock:
+            if self._prober == threading.get_ident():
+                self._prober = None
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logging.info(f"Relayer {'/'.join(self.name)} is answering again, resuming its queries")
+                CIRCUIT_OPEN_GAUGE.set(0, *self.name)
+            self.failures = 0
+            self.opened_at = None
+            self._prober = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._prober = None
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logging.error(f"Relayer {'/'.join(self.name)} failed {self.failures} queries in a row, "
+                                  f"suspending its queries for {self.reset_timeout}s")
+                    CIRCUIT_OPEN_GAUGE.set(1, *self.name)
+                self.opened_at = time.monotonic()
+
+
+class CircuitBreakers:
+    """The circuit breaker of each (namespace, relayer) target, created on first use."""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, namespace: str, relayer: str) -> CircuitBreaker:
+        key = (namespace or "", relayer or "local")
+        with self._lock:
+            if key not in self._breakers:
+                self._breakers[key] = CircuitBreaker(key, self.failure_threshold, self.reset_timeout)
+            return self._breakers[key]
+
+    def configure(self, failure_threshold: int, reset_timeout: float):
+        """Change the thresholds of every breaker, e.g. after the configuration was reloaded."""
+        with self._lock:
+            self.failure_threshold = failure_threshold
+            self.reset_timeout = reset_timeout
+            for breaker in self._breakers.values():
+                breaker.failure_threshold = failure_threshold
+                breaker.reset_timeout = reset_timeout
+
+
+CIRCUIT_BREAKERS = CircuitBreakers(settings.CONFIG["circuit_breaker"]["failure_threshold"],
+                                   settings.CONFIG["circuit_breaker"]["reset_timeout"])
+
+
+def run_query_command(command: list, subcommand: str, namespace: str, relayer: str,
+                      limit: threading.Semaphore = None, timeout: float = None, retries: int = None,
+                      stdin: str = None) -> str:
+    """
+    Run a query command against a target with a timeout, retries and its circuit breaker.
+
+    Each attempt is killed after the timeout of its subcommand. A failed
+    attempt is retried up to query_retries times, after a jittered
+    exponential backoff during which the relayer's slot is released. A query
+    therefore never takes longer than (query_retries + 1) timeouts plus the
+    backoffs. A query probing an open circuit breaker gets a single attempt.
+
+    Args:
+        command (list): The command to be executed as a list of strings.
+        subcommand (str): The rly subcommand being run, which selects the timeout.
+        namespace (str): The namespace in which the relayer is deployed, or None for local commands.
+        relayer (str): The name of the relayer, or None for local commands.
+        limit (threading.Semaphore): Held while each attempt runs, if given.
+        timeout (float): Overrides the timeout of the subcommand, if given.
+        retries (int): Overrides query_retries, if given.
+        stdin (str): Written to the standard input of the command, if given.
+
+    Returns:
+        str: The output of the command.
+
+    Raises:
+        QueryFailed: Every attempt failed, or the target's circuit breaker is open.
+    """
+    breaker = CIRCUIT_BREAKERS.get(namespace, relayer)
+    if timeout is None:
+        timeout = query_timeout(subcommand)
+    if retries is None:
+        retries = settings.CONFIG["query_retries"]
+    attempt = 0
+    while True:
+        if not breaker.allow():
+            raise QueryFailed(f"relayer {'/'.join(breaker.name)} is failing, skipped")
+        probe = breaker.probing()
+        try:
+            with limit or contextlib.nullcontext():
+                output = timed_subprocess_command(command, subcommand, namespace, relayer, timeout, stdin)
+        except QueryFailed as e:
+            if probe or attempt >= retries:
+                breaker.record_failure()
+                raise
+            logging.debug(f"Retrying {subcommand} query on {'/'.join(breaker.name)}, it {e}")
+            if CASSETTE.mode != "replay":
+                time.sleep(random.uniform(0, settings.CONFIG["retry_backoff"] * 2 ** attempt))
+            attempt += 1
+            continue
+        except BaseException:
+            breaker.abandon_probe()
+            raise
+        breaker.record_success()
+        return output
+
+
+def rly_subcommand(args: tuple) -> str:
+    """Return the rly subcommand of a query, e.g. balance for 'q balance akash'."""
+    return args[1] if len(args) > 1 and args[0] == 'q' else args[0]
+
+
+def query_timeout(subcommand: str) -> float:
+    """Return the seconds a query of an rly subcommand may run."""
+    timeouts = settings.CONFIG["query_timeouts"]
+    return timeouts.get(subcommand, timeouts["default"])
+
+
+class Check(NamedTuple):
+    """
+    A relayer query together with the function that reports on its output.
+
+    A check created with an output is reported on without running its query.
+    """
+    namespace: str
+    relayer: str
+    args: tuple
+    report: Callable[[str], None]
+    output: str = None
+
+
+def rly_command(namespace: str, relayer: str, *args: str) -> list:
+    """
+    Build the command that runs rly, inside a relayer deployment when one is given.
+
+    Args:
+        namespace (str): The namespace in which the relayer is deployed, or None to run rly locally.
+        relayer (str): The name of the relayer, or None to run rly locally.
+        *args (str): The arguments passed to rly.
+
+    Returns:
+        list: The command as a list of strings.
+    """
+    args = output_args(args)
+    if namespace is None or relayer is None:
+        return ['rly', *args]
+    return kubectl_command(namespace, relayer, 'rly', *args)
+
+
+# The rly queries that can print JSON, which the parsers read like their text output
+JSON_OUTPUT_QUERIES = {('q', 'balance')}
+
+
+def output_args(args: tuple) -> tuple:
+    """Ask rly for JSON output on the queries that support it, when enabled."""
+    if settings.CONFIG["rly_json_output"] and tuple(args[:2]) in JSON_OUTPUT_QUERIES:
+        return (*args, '--output', 'json')
+    return tuple(args)
+
+
+def kubectl_command(namespace: str, relayer: str, *command: str, stdin: bool = False) -> list:
+    """
+    Build the command that executes a command inside a relayer deployment.
+
+    Args:
+        namespace (str): The namespace in which the relayer is deployed.
+        relayer (str): The name of the relayer.
+        *command (str): The command to execute in the relayer pod.
+        stdin (bool): Whether the standard input is passed on to the command.
+
+    Returns:
+        list: The kubectl command as a list of strings.
+    """
+    options = []
+    cluster = settings.CONFIG["kube_clusters"].get(deployment_cluster(namespace, relayer), {})
+    if cluster.get("kubeconfig"):
+        options += ['--kubeconfig', cluster["kubeconfig"]]
+    if cluster.get("context"):
+        options += ['--context', cluster["context"]]
+    return ['kubectl', *options, 'exec', *(['-i'] if stdin else []), '-q', '-n', namespace,
+            f'deploy/{relayer}', '--', *command]
+
+
+def deployment_cluster(namespace: str, relayer: str) -> str:
+    """
+    Find the cluster a relayer deployment runs in.
+
+    Args:
+        namespace (str): The namespace in which the relayer is deployed.
+        relayer (str): The name of the relayer.
+
+    Returns:
+        str: The name of the cluster, or None for the current kube context.
+    """
+    for category, cluster in settings.CONFIG["clusters"].items():
+        if settings.CONFIG["namespaces"].get(category) == namespace and settings.CONFIG["relayers"].get(category) == relayer:
+            return cluster
+    return None
+
+
+class QueryCache:
+    """
+    Memoize rly query outputs for a limited time.
+
+    Entries are keyed on (namespace, relayer, subcommand, args). Concurrent
+    lookups of a key that is not cached yet share a single in-flight query
+    instead of each spawning their own subprocess. Empty outputs are treated
+    as failures and are never cached.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        # Upper bound on ttl, whatever the configuration says
+        self.max_ttl = float("inf")
+        self._entries = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(namespace: str, relayer: str, args: tuple) -> tuple:
+        return (namespace, relayer, rly_subcommand(args), tuple(args))
+
+    def get(self, key: tuple, fetch: Callable[[], str]) -> str:
+        """
+        Return the cached output for a key, calling fetch to produce it if needed.
+
+        Args:
+            key (tuple): The cache key of the query.
+            fetch (Callable[[], str]): Runs the query and returns its output.
+
+        Returns:
+            str: The output of the query.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                return entry[1]
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+        if not owner:
+            return future.result()
+
+        try:
+            output = fetch()
+        except BaseException as e:
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._inflight[key]
+            ttl = min(self.ttl, self.max_ttl)
+            if output and ttl > 0:
+                self._entries[key] = (time.monotonic() + ttl, output)
+        future.set_result(output)
+        return output
+
+    def cached(self, key: tuple) -> str:
+        """Return the unexpired output for a key, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                return entry[1]
+            return None
+
+    def put(self, key: tuple, output: str):
+        """Store the output of a query that was run outside of get."""
+        with self._lock:
+            ttl = min(self.ttl, self.max_ttl)
+            if output and ttl > 0:
+                self._entries[key] = (time.monotonic() + ttl, output)
+
+    def clear(self):
+        """Forget every cached output."""
+        with self._lock:
+            self._entries.clear()
+
+
+QUERY_CACHE = QueryCache(settings.CONFIG["query_cache_ttl"])
+
+
+def run_rly_query(namespace: str, relayer: str, args: tuple, limit: threading.Semaphore = None) -> str:
+    """
+    Run an rly query through the query cache.
+
+    Balance queries are answered by the LCD backend when it is enabled and
+    knows the wallet address of the chain, and by rly otherwise.
+
+    Args:
+        namespace (str): The namespace in which the relayer is deployed, or None to run rly locally.
+        relayer (str): The name of the relayer, or None to run rly locally.
+        args (tuple): The arguments passed to rly.
+        limit (threading.Semaphore): Held while the subprocess runs, if given.
+
+    Returns:
+        str: The output of the query.
+    """
+    def fetch():
+        if LCD_BACKEND.can_query(namespace, relayer, args):
+            try:
+                return LCD_BACKEND.query(namespace, relayer, args)
+            except (OSError, ValueError, KeyError) as e:
+                logging.warning(f"LCD balance query failed for chain_name: {args[2]}, falling back to rly: {e}")
+        command = rly_command(namespace, relayer, *args)
+        output = run_query_command(command, key[2], namespace, relayer, limit)
+        LCD_BACKEND.learn(namespace, relayer, args, output)
+        return output
+
+    key = QueryCache.key(namespace, relayer, args)
+    return QUERY_CACHE.get(key, fetch)
+
+
+def batch_token(queries: list) -> str:
+    """
+    Return the token that tags the markers of a batch.
+
+    Cassettes match commands exactly, so while one is recorded or replayed
+    the token is derived from the queries instead of being random.
+    """
+    if CASSETTE.mode is None:
+        return secrets.token_hex(8)
+    return hashlib.blake2b(repr(queries).encode(), digest_size=8).hexdigest()
+
+
+def batch_script(queries: list, token: str, concurrency: int = 1) -> str:
+    """
+    Build a shell script that runs several rly queries and frames each output.
+
+    The queries run in rounds of concurrency queries at once, each writing
+    its output to a temporary directory. The outputs are then printed in
+    order, each preceded by a begin marker and followed by an end marker
+    carrying the exit status of the query, both tagged with the query index
+    and a random token so they cannot be confused with rly output.
+
+    Args:
+        queries (list): The rly arguments of each query.
+        token (str): The token included in the markers.
+        concurrency (int): The number of queries run at once.
+
+    Returns:
+        str: The shell script.
+    """
+    lines = ['dir=$(mktemp -d) || exit 1', 'trap \'rm -rf "$dir"\' EXIT']
+    for index, args in enumerate(queries):
+        command = ' '.join(shlex.quote(arg) for arg in ('rly', *output_args(args)))
+        lines.append(f'({command} > "$dir/{index}" 2>/dev/null; echo $? > "$dir/{index}.status") &')
+        if (index + 1) % concurrency == 0 or index == len(queries) - 1:
+            lines.append('wait')
+    for index in range(len(queries)):
+        lines.append(f"printf '\\n--- rly-batch {token} {index} begin ---\\n'")
+        lines.append(f'cat "$dir/{index}"')
+        lines.append(f"printf '\\n--- rly-batch {token} {index} end %s ---\\n' \"$(cat \"$dir/{index}.status\")\"")
+    return '\n'.join(lines)
+
+
+def batch_timeout(queries: list, concurrency: int) -> float:
+    """Return the seconds a batch may run: the timeout of its slowest query per round, and at least the batch timeout."""
+    rounds = -(-len(queries) // concurrency)
+    slowest = max(query_timeout(rly_subcommand(args)) for args in queries)
+    return max(query_timeout("batch"), rounds * slowest)
+
+
+def split_batch_output(output: str, token: str, count: int) -> list:
+    """
+    Split the output of a batch script back into the outputs of its queries.
+
+    Args:
+        output (str): The output of the batch script.
+        token (str): The token included in the markers.
+        count (int): The number of queries in the batch.
+
+    Returns:
+        list: The output of each query, or None where its frame is missing or
+            the query failed.
+    """
+    outputs = [None] * count
+    pattern = re.compile(
+        rf"^--- rly-batch {token} (\d+) begin ---$(.*?)^--- rly-batch {token} \1 end (\d+) ---$",
+        re.MULTILINE | re.DOTALL)
+    for match in pattern.finditer(output):
+        index, body, status = int(match.group(1)), match.group(2), match.group(3)
+        if index >= count:
+            continue
+        if status != "0":
+            logging.debug(f"Batched query {index} exited with status {status}")
+            continue
+        outputs[index] = body.strip()
+    return outputs
+
+
+def prefetch_rly_queries(namespace: str, relayer: str, queries: list, limit: threading.Semaphore = None,
+                         concurrency: int = 1):
+    """
+    Run the uncached queries for a relayer with a single kubectl exec and cache their outputs.
+
+    The script is written to the shell's standard input rather than passed
+    as an argument, so large batches stay clear of the argument size limit.
+    Queries that failed, or whose output cannot be recovered from the batch,
+    are left uncached, so they are run one by one, with retries, when the
+    checks run. The batch itself is therefore not retried.
+
+    Args:
+        namespace (str): The namespace in which the relayer is deployed.
+        relayer (str): The name of the relayer.
+        queries (list): The rly arguments of each query.
+        limit (threading.Semaphore): Held while the subprocess runs, if given.
+        concurrency (int): The number of queries the batch runs at once.
+    """
+    pending = []
+    for args in queries:
+        key = QueryCache.key(namespace, relayer, args)
+        if args not in pending and QUERY_CACHE.cached(key) is None and not LCD_BACKEND.can_query(namespace, relayer, args):
+            pending.append(args)
+    if not pending:
+        return
+
+    token = batch_token(pending)
+    command = kubectl_command(namespace, relayer, settings.CONFIG["batch_shell"], '-s', stdin=True)
+    logging.debug(f"Running {len(pending)} batched queries on {namespace}/{relayer}")
+    try:
+        output = run_query_command(command, "batch", namespace, relayer, limit,
+                                   batch_timeout(pending, concurrency), retries=0,
+                                   stdin=batch_script(pending, token, concurrency))
+    except QueryFailed as e:
+        logging.warning(f"Batched queries on {namespace}/{relayer} failed, running them one by one: {e}")
+        return
+    for args, query_output in zip(pending, split_batch_output(output, token, len(pending))):
+        if query_output is not None:
+            LCD_BACKEND.learn(namespace, relayer, args, query_output)
+            QUERY_CACHE.put(QueryCache.key(namespace, relayer, args), query_output)
+
+
+class CheckExecutor:
+    """
+    Run checks concurrently while reporting their results in submission order.
+
+    Each cluster has its own thread pool, so a slow or unreachable cluster only
+    ties up its own workers, and each relayer deployment is further limited to
+    its own number of in-flight queries so a pod is never flooded. In batch
+    mode the queries for each relayer deployment are first run together with
+    a single kubectl exec.
+    """
+
+    def __init__(self, max_workers: int, relayer_limits: dict, default_limit: int, batch: bool = False,
+                 cluster_workers: dict = None):
+        self._semaphores = {}
+        self._lock = threading.Lock()
+        self.configure(max_workers, relayer_limits, default_limit, batch, cluster_workers)
+
+    @classmethod
+    def from_config(cls) -> "CheckExecutor":
+        """Create an executor with the limits of the current configuration."""
+        return cls(settings.CONFIG["max_workers"], relayer_limits(), settings.CONFIG["default_relayer_concurrency"],
+                   settings.CONFIG["batch_queries"], cluster_workers())
+
+    def configure(self, max_workers: int, relayer_limits: dict, default_limit: int, batch: bool = False,
+                  cluster_workers: dict = None):
+        """Change the limits, e.g. after the configuration was reloaded."""
+        with self._lock:
+            self.max_workers = max_workers
+            self.relayer_limits = relayer_limits
+            self.default_limit = default_limit
+            self.batch = batch
+            self.cluster_workers = cluster_workers or {}
+            # Deployments pick up their new limit on their next query
+            self._semaphores = {}
+
+    def _limit(self, namespace: str, relayer: str) -> int:
+        return max(1, self.relayer_limits.get((namespace, relayer), self.default_limit))
+
+    def _semaphore(self, namespace: str, relayer: str) -> threading.Semaphore:
+        key = (namespace, relayer)
+        with self._lock:
+            if key not in self._semaphores:
+                self._semaphores[key] = threading.Semaphore(self._limit(namespace, relayer))
+            return self._semaphores[key]
+
+    def _query(self, check: Check, prefetch: Future = None) -> str:
+        if check.output is not None:
+            return check.output
+        if prefetch is not None:
+            prefetch.result()
+        with PROFILER.context(*check_target(check)):
+            return run_rly_query(check.namespace, check.relayer, check.args,
+                                 self._semaphore(check.namespace, check.relayer))
+
+    def _prefetch(self, pools: dict, checks: list) -> dict:
+        targets = {}
+        for check in checks:
+            if check.output is None:
+                targets.setdefault((check.namespace, check.relayer), []).append(check.args)
+        return {
+            (namespace, relayer): pools[deployment_cluster(namespace, relayer)].submit(
+                prefetch_rly_queries, namespace, relayer, queries, self._semaphore(namespace, relayer),
+                self._limit(namespace, relayer))
+            for (namespace, relayer), queries in targets.items()
+        }
+
+    def run(self, checks: list):
+        """
+        Run the queries of all checks and report on each output in order.
+
+        Args:
+            checks (list): The checks to run.
+        """
+        if not checks:
+            return
+        clusters = [deployment_cluster(check.namespace, check.relayer) for check in checks]
+        with contextlib.ExitStack() as stack:
+            pools = {
+                cluster: stack.enter_context(ThreadPoolExecutor(
+                    max_workers=self.cluster_workers.get(cluster, self.max_workers),
+                    thread_name_prefix=f"cluster-{cluster or 'default'}"))
+                for cluster in dict.fromkeys(clusters)
+            }
+            # Batches are queued first, so they are never starved by the
+            # queries that wait on them
+            batches = self._prefetch(pools, checks) if self.batch else {}
+            futures = [pools[cluster].submit(self._query, check, batches.get((check.namespace, check.relayer)))
+                       for check, cluster in zip(checks, clusters)]
+            for check, future in zip(checks, futures):
+                try:
+                    output = future.result()
+                except QueryFailed as e:
+                    logging.warning(f"Status unknown for rly {' '.join(check.args)}: {e}")
+                    continue
+                if output:
+                    with PROFILER.context(*check_target(check)):
+                        try:
+                            check.report(output)
+                        except ParseError as e:
+                            logging.error(f"Unexpected output from rly {' '.join(check.args)}: {e}")
+
+
+def check_target(check: Check) -> tuple:
+    """
+    Find the category and the path or chain_name a check is about.
+
+    Args:
+        check (Check): The check.
+
+    Returns:
+        tuple: The category and the path or chain_name, used to attribute profile timings.
+    """
+    category = next((category for category, namespace in settings.CONFIG["namespaces"].items()
+                     if namespace == check.namespace and settings.CONFIG["relayers"].get(category) == check.relayer), "")
+    return category, check.args[2] if len(check.args) > 2 else ""
+
+
+def cluster_workers() -> dict:
+    """
+    Map each cluster to the number of queries run at once in it.
+
+    Returns:
+        dict: The max_workers of each cluster that sets one.
+    """
+    return {name: cluster["max_workers"] for name, cluster in settings.CONFIG["kube_clusters"].items()
+            if "max_workers" in cluster}
+
+
+def relayer_limits() -> dict:
+    """
+    Map each (namespace, relayer) deployment to its configured concurrency limit.
+
+    Returns:
+        dict: The concurrency limit for each configured relayer deployment.
+    """
+    limits = {}
+    for category, limit in settings.CONFIG["relayer_concurrency"].items():
+        namespace = settings.CONFIG["namespaces"].get(category)
+        relayer = settings.CONFIG["relayers"].get(category)
+        if namespace and relayer:
+            key = (namespace, relayer)
+            # Categories sharing a deployment also share the tightest limit
+            limits[key] = min(limit, limits.get(key, limit))
+    return limits
@@ -0,0 +1,310 @@
+"""Declarative alert rules, compiled once and evaluated over all observations of a cycle."""
+import itertools
+import logging
+import math
+import operator
+import re
+import string
+
+OPERATORS = {
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "==": operator.eq,
+}
+
+# Rules at info are only logged, the others also raise an alert
+LEVELS = {"info": logging.INFO, "warning": logging.WARNING, "error": logging.ERROR}
+
+
+class Kind:
+    """
+    A kind of observation: the labels that identify a row and the values rules compare.
+
+    Args:
+        labels (tuple): The string fields of a row, usable in messages.
+        values (tuple): The numeric fields of a row, usable in conditions and messages.
+        subject (str): The template of the alert subject of a row.
+        ok (str): The template of the message logged for a row no rule matches.
+    """
+
+    def __init__(self, labels: tuple, values: tuple, subject: str, ok: str):
+        self.labels = labels
+        self.values = values
+        self.subject = subject
+        self.ok = ok
+
+    @property
+    def fields(self) -> tuple:
+        return self.labels + self.values
+
+
+# What each check observes. baseline and unrelayed on balances are derived
+# when a rule uses them, see Observations.derive
+KINDS = {
+    "balance": Kind(("chain", "denom", "category"), ("balance", "warn", "error", "baseline", "unrelayed"), "{denom}",
+                    "balance ok on chain_name: {chain}. Balance: {balance} {denom}"),
+    "expiration": Kind(("chain", "client", "remaining"), ("expires_in", "warn", "error"), "{client}",
+                       "Client {client} on {chain} will expire in {remaining}"),
+    "unrelayed": Kind(("chain", "channel", "src_summary", "dst_summary"),
+                      ("unrelayed", "src", "dst", "populated", "stuck", "age", "stuck_after"),
+                      "unrelayed packets {channel}", "No unrelayed packets found on chain_name: {chain}"),
+}
+
+# The behavior of the static thresholds, always evaluated before the rules
+# of the config file. Each pair is exclusive so a row gets one of them at most
+DEFAULT_RULES = [
+    {"name": "low balance", "kind": "balance", "level": "error", "when": "balance <= error",
+     "subject": "{denom}", "message": "Low balance detected on chain_name: {chain}. Balance: {balance} {denom}"},
+    {"name": "low balance", "kind": "balance", "level": "warning", "when": "balance <= warn and balance > error",
+     "subject": "{denom}", "message": "Low balance detected on chain_name: {chain}. Balance: {balance} {denom}"},
+    {"name": "client expiration", "kind": "expiration", "level": "error", "when": "expires_in <= error",
+     "subject": "{client}", "message": "Client {client} on {chain} will expire in {remaining}"},
+    {"name": "client expiration", "kind": "expiration", "level": "warning", "when": "expires_in < warn and expires_in > error",
+     "subject": "{client}", "message": "Client {client} on {chain} will expire in {remaining}"},
+    {"name": "unrelayed packets", "kind": "unrelayed", "level": "warning", "when": "stuck > 0",
+     "subject": "unrelayed packets {channel}",
+     "message": "There are unrelayed packets on chain_name: {chain}, {stuck} pending for at least {stuck_after} seconds. "
+                "src: {src_summary}. dst: {dst_summary}"},
+    {"name": "unrelayed packets", "kind": "unrelayed", "level": "info", "when": "unrelayed > 0 and stuck == 0",
+     "subject": "unrelayed packets {channel}",
+     "message": "Unrelayed packets on chain_name: {chain} pending for {age:.0f} seconds, not stuck yet. "
+                "src: {src_summary}. dst: {dst_summary}"},
+]
+
+
+class Observations:
+    """
+    The observations of one cycle, stored as one column per field and kind.
+
+    Rows are only appended, and the order in which they were recorded across
+    kinds is kept so results can be reported in the order the checks ran.
+    Columns a rule needs but no check records are computed on first use by
+    the function registered with derive.
+    """
+
+    def __init__(self):
+        self.tables = {kind: {field: [] for field in spec.labels + spec.values} for kind, spec in KINDS.items()}
+        self.order = []
+        self._derived = {}
+
+    def record(self, kind: str, **fields):
+        """
+        Append a row. Values that are missing or None never match a condition.
+
+        Args:
+            kind (str): One of KINDS.
+            **fields: The labels and values of the row.
+        """
+        table = self.tables[kind]
+        row = self.count(kind)
+        for field in KINDS[kind].labels:
+            table[field].append(fields.get(field, ""))
+        for field in KINDS[kind].values:
+            value = fields.get(field)
+            table[field].append(math.nan if value is None else value)
+        self.order.append((kind, row))
+
+    def count(self, kind: str) -> int:
+        return len(self.tables[kind][KINDS[kind].labels[0]])
+
+    def derive(self, kind: str, field: str, compute):
+        """
+        Compute a column only if a rule compares it.
+
+        Args:
+            kind (str): One of KINDS.
+            field (str): The value the function computes.
+            compute (Callable[[dict], list]): Takes the table of the kind and
+                returns the value of each row.
+        """
+        self._derived[(kind, field)] = compute
+
+    def column(self, kind: str, field: str) -> list:
+        """Return the values of a field for every row of a kind."""
+        table = self.tables[kind]
+        compute = self._derived.pop((kind, field), None)
+        if compute is not None:
+            table[field] = compute(table)
+        return table[field]
+
+    def row(self, kind: str, row: int) -> dict:
+        """Return the fields of one row, for formatting messages."""
+        return {field: column[row] for field, column in self.tables[kind].items()}
+
+
+class Condition:
+    """A comparison of a value with a number or with a percentage of another value."""
+    __slots__ = ("field", "compare", "operand", "factor")
+
+    def __init__(self, field: str, compare, operand, factor: float = 1.0):
+        self.field = field
+        self.compare = compare
+        self.operand = operand
+        self.factor = factor
+
+    def mask(self, observations: Observations, kind: str) -> list:
+        """Evaluate the condition for every row of a kind at once."""
+        left = observations.column(kind, self.field)
+        if not isinstance(self.operand, str):
+            return list(map(self.compare, left, itertools.repeat(self.operand)))
+        right = observations.column(kind, self.operand)
+        if self.factor != 1.0:
+            right = [value * self.factor for value in right]
+        return list(map(self.compare, left, right))
+
+
+class Rule:
+    """A compiled rule: the rows of its kind on which all of its conditions hold get an alert."""
+    __slots__ = ("name", "kind", "level", "conditions", "subject", "message")
+
+    def __init__(self, name: str, kind: str, level: int, conditions: list, subject: str, message: str):
+        self.name = name
+        self.kind = kind
+        self.level = level
+        self.conditions = conditions
+        self.subject = subject
+        self.message = message
+
+    def matches(self, observations: Observations) -> list:
+        """Return the rows of its kind matched by the rule."""
+        masks = [condition.mask(observations, self.kind) for condition in self.conditions]
+        return list(itertools.compress(range(observations.count(self.kind)), map(all, zip(*masks))))
+
+
+def parse_condition(text: str, kind: str) -> Condition:
+    """
+    Compile one comparison of a rule.
+
+    A condition is a value of the kind, an operator, and either a number,
+    another value, or a percentage of another value:
+
+        balance <= 1000000
+        unrelayed > 0
+        balance < 80% baseline
+
+    Args:
+        text (str): The condition.
+        kind (str): The kind of observation the rule applies to.
+
+    Returns:
+        Condition: The compiled condition.
+
+    Raises:
+        ValueError: The condition does not parse or uses an unknown value.
+    """
+    values = KINDS[kind].values
+    tokens = text.split()
+    if len(tokens) not in (3, 4) or tokens[1] not in OPERATORS:
+        raise ValueError(f"'{text}' must be '<value> <operator> <operand>', "
+                         f"with an operator of {' '.join(OPERATORS)}")
+    field, compare, operand = tokens[0], OPERATORS[tokens[1]], tokens[2:]
+    if field not in values:
+        raise ValueError(f"'{field}' is not one of the {kind} values {', '.join(values)}")
+    factor = 1.0
+    if len(operand) == 2:
+        percent, operand = operand
+        if not percent.endswith("%"):
+            raise ValueError(f"'{text}' must compare with a percentage of a value, e.g. 80% {operand}")
+        try:
+            factor = float(percent[:-1]) / 100
+        except ValueError:
+            raise ValueError(f"'{percent}' in '{text}' is not a percentage")
+        if operand not in values:
+            raise ValueError(f"'{operand}' is not one of the {kind} values {', '.join(values)}")
+        return Condition(field, compare, operand, factor)
+    operand = operand[0]
+    if operand in values:
+        return Condition(field, compare, operand)
+    try:
+        return Condition(field, compare, float(operand))
+    except ValueError:
+        raise ValueError(f"'{operand}' in '{text}' is neither a number nor one of the {kind} values {', '.join(values)}")
+
+
+def _check_template(template, kind: str, key: str) -> str:
+    if not isinstance(template, str):
+        raise ValueError(f"{key} must be a string")
+    for _, field, _, _ in string.Formatter().parse(template):
+        if field is not None and field not in KINDS[kind].fields:
+            raise ValueError(f"{key} uses '{{{field}}}', not one of the {kind} fields {', '.join(KINDS[kind].fields)}")
+    return template
+
+
+def compile_rule(spec: dict) -> Rule:
+    """
+    Compile a rule from the config file.
+
+    Args:
+        spec (dict): The rule, with a name, the kind of observation it applies
+            to, a level of warning or error, the conditions in when, either a
+            list or joined with 'and', and optionally the subject and message
+            templates of its alerts.
+
+    Returns:
+        Rule: The compiled rule.
+
+    Raises:
+        ValueError: The rule is invalid, with the reason.
+    """
+    if not isinstance(spec, dict):
+        raise ValueError("must be a mapping")
+    unknown = sorted(set(spec) - {"name", "kind", "level", "when", "subject", "message"})
+    if unknown:
+        raise ValueError(f"unknown settings {', '.join(unknown)}")
+    name = spec.get("name")
+    if not isinstance(name, str) or not name:
+        raise ValueError("name must be a string")
+    kind = spec.get("kind")
+    if kind not in KINDS:
+        raise ValueError(f"kind must be one of {', '.join(KINDS)}")
+    level = str(spec.get("level", "warning")).lower()
+    if level not in LEVELS:
+        raise ValueError(f"level must be one of {', '.join(LEVELS)}")
+    when = spec.get("when")
+    if isinstance(when, str):
+        when = re.split(r"\s+and\s+", when.strip())
+    if not isinstance(when, list) or not when or not all(isinstance(condition, str) for condition in when):
+        raise ValueError("when must be a condition or a list of conditions")
+    conditions = [parse_condition(condition, kind) for condition in when]
+    subject = _check_template(spec.get("subject", f"{KINDS[kind].subject} {name}"), kind, "subject")
+    message = _check_template(spec.get("message", f"Rule {name} matched on chain_name: {{chain}}"), kind, "message")
+    return Rule(name, kind, LEVELS[level], conditions, subject, message)
+
+
+class RuleSet:
+    """
+    Rules compiled once and evaluated together over the observations of a cycle.
+
+    Each condition is evaluated over a whole column at once, so the cost of
+    a cycle grows with the number of conditions rather than with the number
+    of rows times the number of rules.
+    """
+
+    def __init__(self, rules: list):
+        self.rules = rules
+
+    def evaluate(self, observations: Observations) -> dict:
+        """
+        Find the rules matching each row.
+
+        Args:
+            observations (Observations): The observations of a cycle.
+
+        Returns:
+            dict: The matching rules per (kind, row), in rule order, only for
+                rows with at least one match.
+        """
+        matches = {}
+        for rule in self.rules:
+            if not observations.count(rule.kind):
+                continue
+            for row in rule.matches(observations):
+                matches.setdefault((rule.kind, row), []).append(rule)
+        return matches
+
+
+def compile_rules(specs: list) -> RuleSet:
+    """Compile the default rules followed by the rules of the config file."""
+    return RuleSet([compile_rule(spec) for spec in DEFAULT_RULES + list(specs)])
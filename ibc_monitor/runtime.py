@@ -0,0 +1,61 @@
+"""Applying a configuration to the long-lived components."""
+import logging
+
+from . import settings
+from .alerts import ALERTS, create_alert_sinks
+from .discovery import DISCOVERY
+from .history import BALANCE_HISTORY, EXPIRATION_CACHE, PACKET_AGES
+from .lcd import LCD_BACKEND, deployment_accounts
+from .logs import LOG_PIPELINE
+from .queries import CIRCUIT_BREAKERS, QUERY_CACHE
+from .sharding import SHARD
+from .thresholds import invalidate_thresholds
+
+
+def use_config(config: dict):
+    """
+    Swap in a new configuration and apply it to the long-lived components.
+
+    The swap is a single assignment, so a running check sees either the old or
+    the new configuration. Query, expiration and history caches keep their state.
+
+    Args:
+        config (dict): The complete configuration, from validate_config.
+    """
+    previous = settings.CONFIG
+    if config["alert_sinks"] != previous["alert_sinks"] or not ALERTS.sinks:
+        ALERTS.configure(create_alert_sinks(config), config["alert_repeat_interval"])
+    else:
+        ALERTS.repeat_interval = config["alert_repeat_interval"]
+    settings.CONFIG = config
+    invalidate_thresholds()
+    logging.getLogger().setLevel(config["log_level"].value)
+    if LOG_PIPELINE.listener is not None and LOG_PIPELINE.log_format != config["log_format"]:
+        LOG_PIPELINE.start(config["log_format"])
+    QUERY_CACHE.ttl = config["query_cache_ttl"]
+    CIRCUIT_BREAKERS.configure(config["circuit_breaker"]["failure_threshold"],
+                               config["circuit_breaker"]["reset_timeout"])
+    LCD_BACKEND.enabled = config["balance_backend"] == "lcd"
+    LCD_BACKEND.endpoints = config["lcd_endpoints"]
+    LCD_BACKEND.configured_accounts = deployment_accounts(config)
+    LCD_BACKEND.timeout = config["lcd_timeout"]
+    BALANCE_HISTORY.capacity = config["balance_history"]["capacity"]
+    if BALANCE_HISTORY.path != config["balance_history"]["path"]:
+        BALANCE_HISTORY.close()
+        BALANCE_HISTORY.path = config["balance_history"]["path"]
+    EXPIRATION_CACHE.refresh_horizon_days = config["expiration_cache"]["refresh_horizon_days"]
+    EXPIRATION_CACHE.max_age_hours = config["expiration_cache"]["max_age_hours"]
+    if EXPIRATION_CACHE.path != config["expiration_cache"]["path"]:
+        EXPIRATION_CACHE.save()
+        EXPIRATION_CACHE.path = config["expiration_cache"]["path"]
+        EXPIRATION_CACHE.reset()
+    if PACKET_AGES.path != config["packet_ages"]["path"]:
+        PACKET_AGES.save()
+        PACKET_AGES.path = config["packet_ages"]["path"]
+        PACKET_AGES.reset()
+    if config["sharding"] != previous["sharding"] or SHARD.member is None:
+        SHARD.configure(config["sharding"])
+    DISCOVERY.ttl = config["discovery"]["ttl"]
+    if DISCOVERY.path != config["discovery"]["cache_path"]:
+        DISCOVERY.path = config["discovery"]["cache_path"]
+        DISCOVERY.reset()
@@ -0,0 +1,469 @@
+"""Configuration defaults, loading and validation."""
+import copy
+import json
+import logging
+import os
+import threading
+import urllib.parse
+from enum import Enum
+from typing import Callable
+
+from .logs import LOG_FORMATS
+from .rules import compile_rule
+from .sharding import LEASE_BACKENDS
+
+
+class LogLevel(Enum):
+    DEBUG = logging.DEBUG
+    INFO = logging.INFO
+    WARNING = logging.WARNING
+    ERROR = logging.ERROR
+    CRITICAL = logging.CRITICAL
+
+
+# Default configuration. The native tokens, paths, namespaces and relayers
+# are loaded from the config file, see ConfigFile
+CONFIG = {
+    "native": {
+        "tokens": {}
+    },
+    "paths": {},
+    "namespaces": {},
+    "relayers": {},
+    # Maximum number of concurrent queries against each relayer deployment
+    "relayer_concurrency": {},
+    # The cluster each category's relayer runs in, categories without one use
+    # the current kube context
+    "clusters": {},
+    # Per cluster: the kube context and/or kubeconfig to use, and max_workers,
+    # the number of queries run at once in that cluster
+    "kube_clusters": {},
+    "default_relayer_concurrency": 2,
+    "max_workers": 8,
+    # Seconds for which an identical rly query is answered from the cache
+    "query_cache_ttl": 30,
+    # Seconds a query may run before its process group is killed, per rly
+    # subcommand, with "default" for the others. A batch may run for the
+    # timeout of its slowest query per round of queries, and at least "batch"
+    "query_timeouts": {
+        "default": 30,
+        "clients-expiration": 60,
+        "batch": 120
+    },
+    # Attempts after the first for a failed query, and the base of the
+    # exponential, jittered backoff between them in seconds
+    "query_retries": 2,
+    "retry_backoff": 0.5,
+    # Consecutive failed queries after which a relayer deployment is skipped,
+    # and the seconds after which it is tried again
+    "circuit_breaker": {
+        "failure_threshold": 3,
+        "reset_timeout": 60
+    },
+    # Ask rly for JSON output where a query supports it (q balance)
+    "rly_json_output": False,
+    # Run all queries for a relayer with a single kubectl exec through this
+    # shell, as many at once as the relayer's concurrency limit
+    "batch_queries": False,
+    "batch_shell": "sh",
+    # Seconds between runs of each check type in daemon mode
+    "daemon_intervals": {
+        "balance": 60,
+        "unrelayed": 30,
+        "expiration": 6 * 60 * 60
+    },
+    # Fraction by which each daemon interval is randomly stretched or shortened
+    "daemon_jitter": 0.1,
+    # "kubectl" queries balances through the relayer, "lcd" queries them from the
+    # chains' LCD endpoints and falls back to the relayer on failure
+    "balance_backend": "kubectl",
+    # LCD endpoint of each chain_name, e.g. "akash": "https://lcd.example.com"
+    "lcd_endpoints": {},
+    # Wallet address of each category's relayer on each chain_name queried
+    # over LCD, e.g. kujira: {akash: akash1...}. Wallets without one are
+    # learned from their first 'rly q balance' output, so only answer over
+    # LCD from their second query on
+    "lcd_accounts": {},
+    "lcd_timeout": 10,
+    "lcd_pool_size": 4,
+    # Port of the Prometheus /metrics endpoint, disabled when None
+    "metrics_port": None,
+    # Balance samples kept per (chain_name, denom) to project when a balance
+    # runs out, disabled when path is None
+    "balance_history": {
+        "path": None,
+        "capacity": 2016,
+        # Seconds of samples needed before a burn rate is trusted
+        "min_span": 3600,
+        "time_to_empty_warn_hours": 72,
+        "time_to_empty_error_hours": 24
+    },
+    # Client expirations per path, only re-queried once a client comes within
+    # refresh_horizon_days of the warning threshold or the entry is older than
+    # max_age_hours. Disabled when path is None
+    "expiration_cache": {
+        "path": None,
+        "refresh_horizon_days": 2,
+        "max_age_hours": 24
+    },
+    # Unrelayed packets only raise an alert once pending for stuck_after
+    # seconds. The first time each pending sequence was seen is kept in path
+    # between runs, or only in memory when path is None, in which case a
+    # single run reports every pending packet
+    "packet_ages": {
+        "path": None,
+        "stuck_after": 300
+    },
+    # Log every pending sequence of a channel with unrelayed packets, rather
+    # than only their count and ranges
+    "show_unrelayed_sequences": False,
+    # Receivers of warnings and errors, each a mapping with a type of "webhook",
+    # "slack" or "pagerduty", a url, and optionally min_level, rate_limit_per_minute
+    # and, for pagerduty, routing_key
+    "alert_sinks": [],
+    "alert_queue_size": 1000,
+    "alert_timeout": 10,
+    # Seconds during which the same alert is not sent again
+    "alert_repeat_interval": 3600,
+    # Generate path entries from each relayer's 'rly paths list' and keep them
+    # in cache_path for ttl seconds. Paths in the config file take precedence.
+    # Each denom observed on a discovered path gets the default_alerts
+    # thresholds, and without them the balance of discovered paths is not checked
+    "discovery": {
+        "enabled": False,
+        "cache_path": None,
+        "ttl": 6 * 60 * 60,
+        "default_alerts": None
+    },
+    # Split the paths between replicas by consistent hashing. Replicas find each
+    # other through leases held in the backend, "file" keeps them in lease_dir
+    "sharding": {
+        "enabled": False,
+        "backend": "file",
+        "lease_dir": None,
+        "member_id": None,
+        "lease_ttl": 60,
+        "virtual_nodes": 64
+    },
+    # Alert rules evaluated with the static thresholds over everything a run
+    # observed, each a mapping with a name, the kind of observation, a level,
+    # the conditions in when and optionally subject and message templates
+    "rules": [],
+    "expiration_days_threshold_warning": 5,
+    "expiration_days_threshold_error": 2,
+    "log_level": LogLevel.INFO,
+    # "text" (colored on a terminal), "json" or "logfmt"
+    "log_format": "text"
+}
+
+DEFAULT_CONFIG = copy.deepcopy(CONFIG)
+# config.yaml next to app.py, at the root of the repository
+DEFAULT_CONFIG_FILE = os.environ.get(
+    "CONFIG_FILE", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config.yaml"))
+
+
+# The type of each setting whose default is None, which may also be left None
+OPTIONAL_SETTINGS = {
+    "metrics_port": (int, "a port number"),
+    "balance_history.path": (str, "a file path"),
+    "expiration_cache.path": (str, "a file path"),
+    "packet_ages.path": (str, "a file path"),
+    "discovery.cache_path": (str, "a file path"),
+    "discovery.default_alerts": (dict, "a mapping of alerts"),
+    "sharding.lease_dir": (str, "a directory"),
+    "sharding.member_id": (str, "a string"),
+}
+# Numeric settings that must be above zero, and those that may also be zero
+POSITIVE_SETTINGS = (
+    "max_workers", "default_relayer_concurrency", "lcd_timeout", "lcd_pool_size", "alert_queue_size",
+    "alert_timeout", "balance_history.capacity", "circuit_breaker.failure_threshold", "sharding.lease_ttl",
+    "sharding.virtual_nodes",
+)
+NON_NEGATIVE_SETTINGS = (
+    "query_cache_ttl", "query_retries", "retry_backoff", "circuit_breaker.reset_timeout", "daemon_jitter",
+    "balance_history.min_span", "balance_history.time_to_empty_warn_hours",
+    "balance_history.time_to_empty_error_hours", "expiration_cache.refresh_horizon_days",
+    "expiration_cache.max_age_hours", "packet_ages.stuck_after", "alert_repeat_interval", "discovery.ttl",
+    "expiration_days_threshold_warning", "expiration_days_threshold_error",
+)
+# Numeric settings that must also be whole numbers
+INTEGER_SETTINGS = (
+    "max_workers", "default_relayer_concurrency", "lcd_pool_size", "alert_queue_size", "balance_history.capacity",
+    "circuit_breaker.failure_threshold", "sharding.virtual_nodes", "query_retries",
+)
+
+
+class ConfigError(ValueError):
+    """Raised when a config file cannot be read or does not match the schema."""
+
+
+def read_config_file(path: str) -> dict:
+    """
+    Read a YAML, TOML or JSON config file, picked by its extension.
+
+    Args:
+        path (str): The path of the config file.
+
+    Returns:
+        dict: The raw contents of the file.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    try:
+        if extension in (".yaml", ".yml"):
+            try:
+                import yaml
+            except ImportError:
+                raise ConfigError("PyYAML is required to read YAML config files")
+            with open(path) as f:
+                data = yaml.safe_load(f)
+        elif extension == ".toml":
+            import tomllib
+            with open(path, "rb") as f:
+                data = tomllib.load(f)
+        elif extension == ".json":
+            with open(path) as f:
+                data = json.load(f)
+        else:
+            raise ConfigError(f"Unsupported config file type '{extension}'")
+    except ConfigError:
+        raise
+    except Exception as e:
+        raise ConfigError(f"Could not read config file {path}: {e}")
+    if not isinstance(data, dict):
+        raise ConfigError(f"Config file {path} must contain a mapping")
+    return data
+
+
+def _require(condition: bool, where: str, message: str):
+    if not condition:
+        raise ConfigError(f"{where}: {message}")
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _validate_tokens(tokens, where: str):
+    _require(isinstance(tokens, dict), where, "must be a mapping of denom to alerts")
+    for denom, token in tokens.items():
+        alerts = token.get("alerts") if isinstance(token, dict) else None
+        _require(isinstance(alerts, dict), f"{where}.{denom}", "must have alerts")
+        _validate_alerts(alerts, f"{where}.{denom}.alerts")
+
+
+def _validate_alerts(alerts: dict, where: str):
+    for key in ("low_balance_warn_threshold", "low_balance_error_threshold"):
+        value = alerts.get(key)
+        _require(isinstance(value, int) and not isinstance(value, bool) and value >= 0,
+                 f"{where}.{key}", "must be a non-negative integer")
+
+
+def _setting(config: dict, name: str):
+    for key in name.split("."):
+        config = config[key]
+    return config
+
+
+def _validate_setting(value, default, where: str):
+    # Settings take the type of their default, None defaults that of OPTIONAL_SETTINGS
+    if default is None:
+        if where in OPTIONAL_SETTINGS and value is not None:
+            kind, description = OPTIONAL_SETTINGS[where]
+            _require(isinstance(value, kind) and not isinstance(value, bool), where, f"must be {description}")
+        return value
+    if isinstance(default, dict):
+        _require(isinstance(value, dict), where, "must be a mapping")
+        merged = dict(default)
+        for key, item in value.items():
+            if default and key not in default:
+                raise ConfigError(f"{where}.{key}: unknown setting")
+            merged[key] = _validate_setting(item, default.get(key), f"{where}.{key}")
+        return merged
+    if isinstance(default, bool):
+        _require(isinstance(value, bool), where, "must be true or false")
+    elif _is_number(default):
+        _require(_is_number(value), where, "must be a number")
+    elif isinstance(default, str):
+        _require(isinstance(value, str), where, "must be a string")
+    return value
+
+
+def validate_config(data: dict) -> dict:
+    """
+    Check raw config file contents against the schema and fill in the defaults.
+
+    Args:
+        data (dict): The raw contents of a config file.
+
+    Returns:
+        dict: The complete configuration.
+    """
+    unknown = sorted(set(data) - set(DEFAULT_CONFIG))
+    _require(not unknown, "config", f"unknown settings {', '.join(unknown)}")
+
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    for key, value in data.items():
+        if key == "log_level":
+            _require(isinstance(value, str) and value.upper() in LogLevel.__members__, key,
+                     f"must be one of {', '.join(LogLevel.__members__)}")
+            config[key] = LogLevel[value.upper()]
+        elif key in ("native", "paths", "namespaces", "relayers", "relayer_concurrency",
+                     "clusters", "kube_clusters", "daemon_intervals", "lcd_endpoints", "lcd_accounts"):
+            _require(isinstance(value, dict), key, "must be a mapping")
+            config[key] = value
+        elif key == "query_timeouts":
+            _require(isinstance(value, dict), key, "must be a mapping")
+            for subcommand, timeout in value.items():
+                _require(_is_number(timeout) and timeout > 0, f"{key}.{subcommand}", "must be a positive number")
+            config[key] = {**DEFAULT_CONFIG[key], **value}
+        else:
+            config[key] = _validate_setting(value, DEFAULT_CONFIG[key], key)
+
+    _require(config["sharding"]["backend"] in LEASE_BACKENDS, "sharding.backend",
+             f"must be one of {', '.join(LEASE_BACKENDS)}")
+    if config["sharding"]["enabled"] and config["sharding"]["backend"] == "file":
+        _require(isinstance(config["sharding"]["lease_dir"], str), "sharding.lease_dir", "must be a directory")
+    _require(config["log_format"] in LOG_FORMATS, "log_format", f"must be one of {', '.join(LOG_FORMATS)}")
+    _validate_tokens(config["native"].get("tokens", {}), "native.tokens")
+    if config["discovery"]["default_alerts"] is not None:
+        _validate_alerts(config["discovery"]["default_alerts"], "discovery.default_alerts")
+    config["native"].setdefault("tokens", {})
+    for category, category_paths in config["paths"].items():
+        _require(isinstance(category_paths, dict), f"paths.{category}", "must be a mapping of path name to path")
+        # The paths of a category to the same chain_name share the relayer's wallet on it
+        wallet_thresholds = {}
+        for name, path in category_paths.items():
+            where = f"paths.{category}.{name}"
+            _require(isinstance(path, dict), where, "must be a mapping")
+            for key in ("chain_name", "channel"):
+                _require(isinstance(path.get(key), str), f"{where}.{key}", "must be a string")
+            _validate_tokens(path.get("tokens"), f"{where}.tokens")
+            for denom, token in path["tokens"].items():
+                first, alerts = wallet_thresholds.setdefault((path["chain_name"], denom), (name, token["alerts"]))
+                _require(alerts == token["alerts"], f"{where}.tokens.{denom}.alerts",
+                         f"must match paths.{category}.{first}, which uses the same {path['chain_name']} wallet")
+        for key in ("namespaces", "relayers"):
+            _require(isinstance(config[key].get(category), str), f"{key}.{category}",
+                     "must be set for every category of paths")
+    for name in POSITIVE_SETTINGS + NON_NEGATIVE_SETTINGS:
+        value = _setting(config, name)
+        positive = name in POSITIVE_SETTINGS
+        whole = name in INTEGER_SETTINGS
+        _require((value > 0 if positive else value >= 0) and (isinstance(value, int) or not whole), name,
+                 f"must be a {'positive' if positive else 'non-negative'} {'integer' if whole else 'number'}")
+    _require(config["daemon_jitter"] < 1, "daemon_jitter", "must be below 1")
+    if config["metrics_port"] is not None:
+        _require(0 < config["metrics_port"] < 65536, "metrics_port", "must be a port number")
+    for chain_name, endpoint in config["lcd_endpoints"].items():
+        _require(isinstance(endpoint, str) and urllib.parse.urlsplit(endpoint).scheme in ("http", "https"),
+                 f"lcd_endpoints.{chain_name}", "must be an http or https URL")
+    for category, accounts in config["lcd_accounts"].items():
+        _require(category in config["relayers"], f"lcd_accounts.{category}", "must be a category with a relayer")
+        _require(isinstance(accounts, dict), f"lcd_accounts.{category}", "must be a mapping of chain_name to address")
+        for chain_name, account in accounts.items():
+            _require(isinstance(account, str) and account, f"lcd_accounts.{category}.{chain_name}",
+                     "must be a wallet address")
+    for name, cluster in config["kube_clusters"].items():
+        where = f"kube_clusters.{name}"
+        _require(isinstance(cluster, dict), where, "must be a mapping")
+        unknown = sorted(set(cluster) - {"context", "kubeconfig", "max_workers"})
+        _require(not unknown, where, f"unknown settings {', '.join(unknown)}")
+        for key in ("context", "kubeconfig"):
+            _require(isinstance(cluster.get(key, ""), str), f"{where}.{key}", "must be a string")
+        workers = cluster.get("max_workers", 1)
+        _require(isinstance(workers, int) and not isinstance(workers, bool) and workers > 0,
+                 f"{where}.max_workers", "must be a positive integer")
+    deployments = {}
+    for category, cluster in config["clusters"].items():
+        _require(cluster in config["kube_clusters"], f"clusters.{category}", "must name one of kube_clusters")
+    for category, relayer in config["relayers"].items():
+        # Queries are routed by deployment, so a deployment can only live in one cluster
+        deployment = (config["namespaces"].get(category), relayer)
+        cluster = config["clusters"].get(category)
+        _require(deployments.setdefault(deployment, cluster) == cluster, f"clusters.{category}",
+                 f"must match the other categories using deploy/{relayer} in {deployment[0]}")
+    _require(isinstance(config["alert_sinks"], list), "alert_sinks", "must be a list")
+    for index, sink in enumerate(config["alert_sinks"]):
+        where = f"alert_sinks[{index}]"
+        _require(isinstance(sink, dict), where, "must be a mapping")
+        _require(sink.get("type") in ("webhook", "slack", "pagerduty"), f"{where}.type",
+                 "must be webhook, slack or pagerduty")
+        _require(isinstance(sink.get("url"), str) and urllib.parse.urlsplit(sink["url"]).scheme in ("http", "https"),
+                 f"{where}.url", "must be an http or https URL")
+        _require(str(sink.get("min_level", "WARNING")).upper() in LogLevel.__members__, f"{where}.min_level",
+                 f"must be one of {', '.join(LogLevel.__members__)}")
+        _require(_is_number(sink.get("rate_limit_per_minute", 6)) and sink.get("rate_limit_per_minute", 6) > 0,
+                 f"{where}.rate_limit_per_minute", "must be a positive number")
+        if sink["type"] == "pagerduty":
+            _require(isinstance(sink.get("routing_key"), str), f"{where}.routing_key", "must be a string")
+    _require(isinstance(config["rules"], list), "rules", "must be a list")
+    for index, rule in enumerate(config["rules"]):
+        try:
+            compile_rule(rule)
+        except ValueError as e:
+            raise ConfigError(f"rules[{index}]: {e}")
+    for category, limit in config["relayer_concurrency"].items():
+        _require(isinstance(limit, int) and limit > 0, f"relayer_concurrency.{category}", "must be a positive integer")
+    for check_type in DEFAULT_CONFIG["daemon_intervals"]:
+        interval = config["daemon_intervals"].get(check_type, DEFAULT_CONFIG["daemon_intervals"][check_type])
+        _require(_is_number(interval) and interval > 0, f"daemon_intervals.{check_type}", "must be a positive number")
+    config["daemon_intervals"] = {**DEFAULT_CONFIG["daemon_intervals"], **config["daemon_intervals"]}
+    return config
+
+
+class ConfigFile:
+    """
+    A config file that is parsed on first use and reloaded when it changes on disk.
+
+    Changes are detected by comparing the modification time and size of the
+    file. A file that fails to parse or validate on reload is reported and the
+    previous configuration stays in use.
+    """
+
+    def __init__(self, path: str, overrides: Callable[[dict], None] = None):
+        self.path = path
+        self.overrides = overrides
+        self._stamp = None
+        self._lock = threading.Lock()
+
+    def _stat(self) -> tuple:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            raise ConfigError(f"Config file {self.path} not found")
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _read(self) -> dict:
+        stamp = self._stat()
+        config = validate_config(read_config_file(self.path))
+        if self.overrides is not None:
+            self.overrides(config)
+        self._stamp = stamp
+        return config
+
+    def load(self) -> dict:
+        """Parse and validate the file."""
+        with self._lock:
+            return self._read()
+
+    def reload_if_changed(self) -> dict:
+        """
+        Parse the file again if it changed since it was last read.
+
+        Returns:
+            dict: The new configuration, or None when the file did not change
+                or the new contents are invalid.
+        """
+        with self._lock:
+            stamp = None
+            try:
+                stamp = self._stat()
+                if stamp == self._stamp:
+                    return None
+                return self._read()
+            except ConfigError as e:
+                logging.error(f"Keeping the current configuration: {e}")
+                # Report a broken file once, not on every run
+                if stamp is not None:
+                    self._stamp = stamp
+                return None
@@ -0,0 +1,149 @@
+"""Splitting the paths between monitor replicas."""
+import bisect
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import socket
+import time
+import urllib.parse
+
+
+class FileLeaseBackend:
+    """
+    Leases kept as one file per member in a shared directory.
+
+    A stand-in for a real coordination service, for tests and for replicas
+    sharing a volume. Another backend only needs the same three methods.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _file(self, member: str) -> str:
+        return os.path.join(self.directory, f"{urllib.parse.quote(member, safe='')}.lease")
+
+    def renew(self, member: str, ttl: float):
+        """Hold or extend the lease of a member for ttl seconds."""
+        os.makedirs(self.directory, exist_ok=True)
+        temporary = f"{self._file(member)}.tmp"
+        with open(temporary, "w") as f:
+            json.dump({"member": member, "expires_at": time.time() + ttl}, f)
+        os.replace(temporary, self._file(member))
+
+    def members(self) -> list:
+        """Return the members whose lease has not expired."""
+        now = time.time()
+        members = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".lease"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    lease = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if lease["expires_at"] > now:
+                members.append(lease["member"])
+        return members
+
+    def release(self, member: str):
+        """Give up the lease of a member, so the others take over its share at once."""
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self._file(member))
+
+
+LEASE_BACKENDS = {"file": FileLeaseBackend}
+
+
+class HashRing:
+    """Consistent hashing of keys onto members, with virtual nodes to even out the shares."""
+
+    def __init__(self, members: list, virtual_nodes: int):
+        self.members = sorted(members)
+        points = sorted((self.hash(f"{member}#{index}"), member)
+                        for member in self.members for index in range(virtual_nodes))
+        self._hashes = [point for point, _ in points]
+        self._owners = [member for _, member in points]
+
+    @staticmethod
+    def hash(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+    def owner(self, key: str) -> str:
+        """Return the member a key belongs to, or None when there are no members."""
+        if not self._hashes:
+            return None
+        index = bisect.bisect(self._hashes, self.hash(key)) % len(self._hashes)
+        return self._owners[index]
+
+
+class ShardMembership:
+    """
+    The share of the paths checked by this replica when sharding is enabled.
+
+    Replicas hold a lease in the configured backend and hash each (category,
+    path) onto the ring of members with a live lease, so every path has exactly
+    one owner once the replicas agree on the membership. Adding or removing a
+    replica only moves the paths next to it on the ring.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.backend = None
+        self.member = None
+        self.lease_ttl = 60
+        self.virtual_nodes = 64
+        self.ring = None
+
+    def configure(self, settings: dict):
+        """Apply the sharding section of the configuration."""
+        self.enabled = settings["enabled"]
+        self.lease_ttl = settings["lease_ttl"]
+        self.virtual_nodes = settings["virtual_nodes"]
+        self.member = settings["member_id"] or f"{socket.gethostname()}-{os.getpid()}"
+        self.backend = LEASE_BACKENDS[settings["backend"]](settings["lease_dir"]) if self.enabled else None
+        self.ring = None
+
+    def refresh(self):
+        """Renew this replica's lease and recompute its share if the membership changed."""
+        if not self.enabled:
+            return
+        try:
+            self.backend.renew(self.member, self.lease_ttl)
+            members = self.backend.members()
+        except OSError as e:
+            # Keep the last known share rather than checking everything or nothing
+            logging.error(f"Could not renew the shard lease of {self.member}: {e}")
+            return
+        if self.member not in members:
+            members.append(self.member)
+        if self.ring is None or self.ring.members != sorted(members):
+            self.ring = HashRing(members, self.virtual_nodes)
+            logging.info(f"Shard membership changed: {len(members)} replicas, this is {self.member}")
+
+    def release(self):
+        """Give up this replica's lease."""
+        if self.enabled:
+            with contextlib.suppress(OSError):
+                self.backend.release(self.member)
+
+    def owns(self, category: str, path: str = None) -> bool:
+        """
+        Tell whether this replica checks a path, or the native balance of a category.
+
+        Args:
+            category (str): The category.
+            path (str): The path name, or None for the category's native balance.
+
+        Returns:
+            bool: True if this replica checks it.
+        """
+        if not self.enabled or self.ring is None:
+            return True
+        key = category if path is None else f"{category}/{path}"
+        return self.ring.owner(key) == self.member
+
+
+SHARD = ShardMembership()
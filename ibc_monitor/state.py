@@ -0,0 +1,59 @@
+"""State kept between runs in JSON files."""
+import json
+import logging
+import os
+import threading
+
+
+class JSONState:
+    """
+    Entries shared between threads, kept in memory and in an optional JSON file.
+
+    The file is read on first use and written back by save, atomically and
+    only when an entry changed. Subclasses read and change the entries with
+    _load while holding _lock, and set _dirty when they change them.
+
+    Args:
+        path (str): The JSON file, or None to keep the entries in memory only.
+    """
+    # What the file holds, for the warning about an unreadable file
+    description = "state"
+    # Passed to json.dump, e.g. (",", ":") for a compact file
+    separators = None
+
+    def __init__(self, path: str):
+        self.path = path
+        self._entries = None
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def _load(self) -> dict:
+        if self._entries is None:
+            self._entries = {}
+            if self.path:
+                try:
+                    with open(self.path) as f:
+                        self._entries = json.load(f)
+                except FileNotFoundError:
+                    pass
+                except (OSError, ValueError) as e:
+                    logging.warning(f"Ignoring unreadable {self.description} {self.path}: {e}")
+        return self._entries
+
+    def reset(self):
+        """Forget the loaded entries, so they are read again from the file."""
+        with self._lock:
+            self._entries = None
+            self._dirty = False
+
+    def save(self):
+        """Write the entries to disk if they changed, replacing the file atomically."""
+        with self._lock:
+            if not self.path or not self._dirty:
+                return
+            # Named after the process, so replicas sharing the file never write the same temporary file
+            temporary = f"{self.path}.{os.getpid()}.tmp"
+            with open(temporary, "w") as f:
+                json.dump(self._entries, f, separators=self.separators)
+            os.replace(temporary, self.path)
+            self._dirty = False
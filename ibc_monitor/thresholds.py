@@ -0,0 +1,67 @@
+"""Low balance thresholds and alert rules compiled for lookup."""
+from . import settings
+from .rules import RuleSet, compile_rules
+
+
+class Threshold:
+    """The low balance thresholds of one denom of a wallet."""
+    __slots__ = ("warn", "error")
+
+    def __init__(self, warn: int, error: int):
+        self.warn = warn
+        self.error = error
+
+
+class ThresholdIndex:
+    """
+    The low balance thresholds of settings.CONFIG compiled into flat lookups.
+
+    The thresholds of a wallet are mapped by denom. Path wallets are keyed on
+    the (category, chain_name) of each path, as each category's relayer has
+    its own wallet on a chain, and native wallets on their category.
+    validate_config ensures the paths sharing a wallet agree on its
+    thresholds.
+    """
+
+    def __init__(self, config: dict):
+        self.paths = {}
+        self.native = {}
+        for category, category_paths in config["paths"].items():
+            for path in category_paths.values():
+                wallet = self.paths.setdefault((category, path["chain_name"]), {})
+                for denom, token in path.get("tokens", {}).items():
+                    wallet[denom] = compile_threshold(token)
+            self.native[category] = {denom: compile_threshold(token)
+                                     for denom, token in config["native"]["tokens"].items()}
+
+
+def compile_threshold(token: dict) -> Threshold:
+    alerts = token["alerts"]
+    return Threshold(int(alerts["low_balance_warn_threshold"]), int(alerts["low_balance_error_threshold"]))
+
+
+_threshold_index = None
+_rule_set = None
+
+
+def threshold_index() -> ThresholdIndex:
+    """Return the compiled thresholds, compiling settings.CONFIG on first use."""
+    global _threshold_index
+    if _threshold_index is None:
+        _threshold_index = ThresholdIndex(settings.CONFIG)
+    return _threshold_index
+
+
+def rule_set() -> RuleSet:
+    """Return the compiled alert rules, compiling settings.CONFIG on first use."""
+    global _rule_set
+    if _rule_set is None:
+        _rule_set = compile_rules(settings.CONFIG["rules"])
+    return _rule_set
+
+
+def invalidate_thresholds():
+    """Recompile the thresholds and rules on next use, after settings.CONFIG changed."""
+    global _threshold_index, _rule_set
+    _threshold_index = None
+    _rule_set = None
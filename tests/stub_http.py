@@ -0,0 +1,74 @@
+"""A stand-in HTTP server for the tests of the alert sinks and the LCD backend."""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubServer:
+    """
+    A local HTTP server answering JSON requests with a function.
+
+    Every request is recorded in requests as (method, path, body). With
+    close_idle, each connection is closed after its first response although
+    the response allows keep-alive, like a server whose idle timeout expired.
+
+    Args:
+        respond (Callable[[str, str, dict], tuple]): Takes the method, path and
+            decoded body of a request and returns the status and the JSON body
+            of the response. Every request gets an empty 200 by default.
+        close_idle (bool): Close each connection after answering.
+    """
+
+    def __init__(self, respond=None, close_idle: bool = False):
+        self.respond = respond or (lambda method, path, body: (200, {}))
+        self.close_idle = close_idle
+        self.requests = []
+        self.connections = 0
+        self._changed = threading.Condition()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with stub._changed:
+                    stub.connections += 1
+
+            def handle_request(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                status, answer = stub.respond(self.command, self.path, body)
+                data = json.dumps(answer).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                self.wfile.flush()
+                self.close_connection = stub.close_idle
+                with stub._changed:
+                    stub.requests.append((self.command, self.path, body))
+                    stub._changed.notify_all()
+
+            do_GET = do_POST = handle_request
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self) -> "StubServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def wait_for(self, count: int, timeout: float = 5) -> bool:
+        """Wait until at least count requests were answered, returning False on timeout."""
+        with self._changed:
+            return self._changed.wait_for(lambda: len(self.requests) >= count, timeout)
@@ -0,0 +1,99 @@
+import logging
+import time
+import unittest
+
+from ibc_monitor.alerts import Alert, AlertDispatcher, AlertSink
+
+from .stub_http import StubServer
+
+
+def alert(subject: str, level: int = logging.WARNING, chain: str = "akash") -> Alert:
+    return Alert(level, chain, subject, f"{subject} on {chain}", time.time())
+
+
+def sent_subjects(request: tuple) -> list:
+    return [sent["subject"] for sent in request[2]["alerts"]]
+
+
+class AlertSinkTest(unittest.TestCase):
+
+    def test_flush_sends_one_batch(self):
+        with StubServer() as server:
+            sink = AlertSink(server.url + "/hook", 6, 100, 5)
+            for subject in ("uakt", "uatom", "info only"):
+                sink.submit(alert(subject, logging.INFO if subject == "info only" else logging.WARNING))
+            sink.submit(AlertDispatcher.FLUSH)
+            self.assertTrue(server.wait_for(1))
+            sink.submit(AlertDispatcher.STOP)
+            sink.join(5)
+        self.assertEqual(len(server.requests), 1)
+        method, path, _ = server.requests[0]
+        self.assertEqual((method, path), ("POST", "/hook"))
+        self.assertEqual(sent_subjects(server.requests[0]), ["uakt", "uatom"])
+
+    def test_rate_limited_batch_is_merged_into_the_next(self):
+        with StubServer() as server:
+            sink = AlertSink(server.url, 1, 100, 5)
+            sink.submit(alert("uakt"))
+            sink.submit(AlertDispatcher.FLUSH)
+            self.assertTrue(server.wait_for(1))
+            sink.submit(alert("uatom"))
+            sink.submit(AlertDispatcher.FLUSH)
+            self.assertFalse(server.wait_for(2, timeout=0.3))
+            # A minute later the limit lets one more batch through
+            sink._refilled -= 60
+            sink.submit(alert("uosmo"))
+            sink.submit(AlertDispatcher.FLUSH)
+            self.assertTrue(server.wait_for(2))
+            sink.submit(AlertDispatcher.STOP)
+            sink.join(5)
+        self.assertEqual(sent_subjects(server.requests[1]), ["uatom", "uosmo"])
+
+    def test_reconnects_when_the_receiver_closed_an_idle_connection(self):
+        with StubServer(close_idle=True) as server:
+            sink = AlertSink(server.url, 6, 100, 5)
+            for subject in ("uakt", "uatom"):
+                sink.submit(alert(subject))
+                sink.submit(AlertDispatcher.FLUSH)
+                self.assertTrue(server.wait_for(len(server.requests) + 1))
+            sink.submit(AlertDispatcher.STOP)
+            sink.join(5)
+        self.assertEqual([sent_subjects(request) for request in server.requests], [["uakt"], ["uatom"]])
+        self.assertEqual(server.connections, 2)
+
+
+class AlertDispatcherTest(unittest.TestCase):
+
+    def test_repeated_alert_is_sent_once(self):
+        dispatcher = AlertDispatcher(3600)
+        with StubServer() as server:
+            for _ in range(2):
+                dispatcher.configure([AlertSink(server.url, 6, 100, 5)], 3600)
+                dispatcher.submit(alert("uakt"))
+                dispatcher.submit(alert("uakt", logging.ERROR))
+                dispatcher.close(5)
+        self.assertEqual(len(server.requests), 1)
+        self.assertEqual([sent["severity"] for sent in server.requests[0][2]["alerts"]], ["warning", "error"])
+
+    def test_failing_receiver_keeps_the_batch(self):
+        statuses = [500, 200]
+
+        def respond(method, path, body):
+            return statuses.pop(0), {}
+
+        dispatcher = AlertDispatcher(3600)
+        with StubServer(respond) as server, self.assertLogs(level=logging.WARNING) as logs:
+            dispatcher.configure([AlertSink(server.url, 6, 100, 5)], 3600)
+            dispatcher.submit(alert("uakt"))
+            dispatcher.flush()
+            self.assertTrue(server.wait_for(1))
+            # Not delivered yet, so the next run raising it again is not deduplicated
+            dispatcher.submit(alert("uakt"))
+            dispatcher.close(5)
+        self.assertEqual(len(server.requests), 2)
+        self.assertEqual(sent_subjects(server.requests[1]), ["uakt"])
+        self.assertIn("Could not deliver 1 alerts", logs.output[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import tempfile
+import unittest
+
+from ibc_monitor.cassette import FOOTER, Cassette, CassetteError
+
+
+class CassetteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "run.cassette")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def record(self, commands: list) -> Cassette:
+        cassette = Cassette()
+        cassette.start_recording(self.path)
+        for index, (key, output, failed) in enumerate(commands):
+            cassette.add(key, output, cassette._started + index, 0.1, failed)
+        return cassette
+
+    def assert_replays(self, cassette: Cassette):
+        cassette.start_replay(self.path)
+        self.assertEqual(cassette.play("rly q balance akash"), ("first", False))
+        self.assertEqual(cassette.play("rly q balance akash"), ("second", False))
+        # The last recording repeats
+        self.assertEqual(cassette.play("rly q balance akash"), ("second", False))
+        self.assertEqual(cassette.play("rly q balance osmosis"), ("timed out after 5s", True))
+        with self.assertRaises(KeyError):
+            cassette.play("rly q balance kava")
+        cassette.close()
+
+    def commands(self) -> list:
+        filler = [(f"rly q balance chain-{index}", f"output {index}", False) for index in range(50)]
+        return filler[:20] + [("rly q balance akash", "first", False), ("rly q balance osmosis", "timed out after 5s", True),
+                              ("rly q balance akash", "second", False)] + filler[20:]
+
+    def test_indexed_cassette_is_replayed(self):
+        cassette = self.record(self.commands())
+        cassette.close()
+        self.assert_replays(cassette)
+
+    def test_interrupted_recording_is_scanned(self):
+        cassette = self.record(self.commands())
+        # Left without its index, and cut off in the middle of the last record
+        cassette._file.truncate(cassette._file.tell() - 3)
+        cassette._file.close()
+        cassette.mode = None
+        self.assertGreater(os.path.getsize(self.path), FOOTER.size)
+        self.assert_replays(Cassette())
+
+    def test_other_files_are_rejected(self):
+        with open(self.path, "w") as f:
+            f.write("not a cassette")
+        with self.assertRaises(CassetteError):
+            Cassette().start_replay(self.path)
+        with self.assertRaises(CassetteError):
+            Cassette().start_replay(os.path.join(self.directory.name, "missing.cassette"))
+
+
+if __name__ == "__main__":
+    unittest.main()
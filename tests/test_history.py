@@ -0,0 +1,44 @@
+import os
+import tempfile
+import unittest
+
+from ibc_monitor.history import BalanceHistory, age_runs, stuck_packets
+
+
+class PacketAgesTest(unittest.TestCase):
+
+    def test_first_seen_times_carry_over(self):
+        runs = age_runs([[5, 9, 100.0]], [[5, 7], [9, 12]], 200.0)
+        # 8 was relayed, 10-12 are new
+        self.assertEqual(runs, [[5, 7, 100.0], [9, 9, 100.0], [10, 12, 200.0]])
+        self.assertEqual(stuck_packets(runs, 450.0, 300), (4, 350.0))
+
+    def test_new_relayed_and_adjacent_runs(self):
+        self.assertEqual(age_runs([], [[1, 3]], 5.0), [[1, 3, 5.0]])
+        self.assertEqual(age_runs([[1, 10, 1.0]], [], 5.0), [])
+        self.assertEqual(age_runs([[1, 2, 1.0], [3, 4, 2.0]], [[1, 4]], 5.0), [[1, 2, 1.0], [3, 4, 2.0]])
+        # A run spanning two pending ranges keeps its time in both
+        self.assertEqual(age_runs([[1, 10, 1.0]], [[2, 3], [8, 12]], 5.0),
+                         [[2, 3, 1.0], [8, 10, 1.0], [11, 12, 5.0]])
+        self.assertEqual(stuck_packets([], 5.0, 0), (0, None))
+
+
+class BalanceHistoryTest(unittest.TestCase):
+
+    def test_capacity_change_keeps_the_newest_samples(self):
+        with tempfile.TemporaryDirectory() as directory:
+            history = BalanceHistory(os.path.join(directory, "history.sqlite3"), 5)
+            key = ("kujira", "akash", "uakt")
+            for index in range(12):
+                history.append(*key, 100 + index, timestamp=index)
+            history.capacity = 3
+            history.append(*key, 200, timestamp=12)
+            self.assertEqual(history.samples(*key), [(10.0, 110), (11.0, 111), (12.0, 200)])
+            self.assertAlmostEqual(history.baselines([key])[key], (110 + 111 + 200) / 3)
+            # Another category's wallet on the same chain is a series of its own
+            self.assertEqual(history.samples("odin", "akash", "uakt"), [])
+            history.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+
+from ibc_monitor.lcd import HTTPError, LCDBalanceBackend
+from ibc_monitor.parsers import parse_balance
+
+from .stub_http import StubServer
+
+ACCOUNT = "akash1qy352eufqy352eufqy352eufqy352eufkr4sv6"
+OTHER_ACCOUNT = "akash1zg69v7yszg69v7yszg69v7yszg69v7ys8xdv96"
+IBC_HASH = "27394FB092D2ECCD56123C74F36E4C1F926001CEADA9CA97EA622B25F41E5EB2"
+
+
+def lcd(method: str, path: str, body: dict) -> tuple:
+    """Answer like an LCD endpoint holding two pages of balances and one denom trace."""
+    if path == f"/cosmos/bank/v1beta1/balances/{ACCOUNT}":
+        return 200, {"balances": [{"denom": "uakt", "amount": "5000000"}], "pagination": {"next_key": "page2"}}
+    if path == f"/cosmos/bank/v1beta1/balances/{ACCOUNT}?pagination.key=page2":
+        return 200, {"balances": [{"denom": f"ibc/{IBC_HASH}", "amount": "42"}], "pagination": {"next_key": None}}
+    if path == f"/ibc/apps/transfer/v1/denom_traces/{IBC_HASH}":
+        return 200, {"denom_trace": {"path": "transfer/channel-17", "base_denom": "uatom"}}
+    if path == f"/cosmos/bank/v1beta1/balances/{OTHER_ACCOUNT}":
+        return 200, {"balances": [{"denom": "uakt", "amount": "7"}], "pagination": {"next_key": None}}
+    return 404, {}
+
+
+class LCDBalanceBackendTest(unittest.TestCase):
+
+    def backend(self, server: StubServer, accounts: dict = None) -> LCDBalanceBackend:
+        backend = LCDBalanceBackend({"akash": server.url}, 5, 2, accounts)
+        backend.enabled = True
+        return backend
+
+    def test_configured_account_is_queried_without_the_relayer(self):
+        with StubServer(lcd) as server:
+            backend = self.backend(server, {("kujira", "relayer", "akash"): ACCOUNT})
+            self.assertTrue(backend.can_query("kujira", "relayer", ('q', 'balance', 'akash')))
+            balance = parse_balance(backend.query("kujira", "relayer", ('q', 'balance', 'akash')))
+        self.assertEqual(balance["account"], ACCOUNT)
+        self.assertEqual(balance["balances"], [{"amount": 5000000, "denom": "uakt"},
+                                               {"amount": 42, "denom": "transfer/channel-17/uatom"}])
+
+    def test_account_is_learned_from_rly_output(self):
+        with StubServer(lcd) as server:
+            backend = self.backend(server)
+            self.assertFalse(backend.can_query("kujira", "relayer", ('q', 'balance', 'akash')))
+            backend.learn("kujira", "relayer", ('q', 'balance', 'akash'), f"address {{{ACCOUNT}}} balance {{1uakt}}")
+            self.assertTrue(backend.can_query("kujira", "relayer", ('q', 'balance', 'akash')))
+            self.assertFalse(backend.can_query("kujira", "relayer", ('q', 'balance', 'osmosis')))
+            backend.enabled = False
+            self.assertFalse(backend.can_query("kujira", "relayer", ('q', 'balance', 'akash')))
+
+    def test_deployments_on_one_chain_keep_their_own_wallet(self):
+        with StubServer(lcd) as server:
+            backend = self.backend(server)
+            backend.learn("kujira", "relayer", ('q', 'balance', 'akash'), f"address {{{ACCOUNT}}} balance {{1uakt}}")
+            self.assertFalse(backend.can_query("osmosis", "relayer", ('q', 'balance', 'akash')))
+            backend.learn("osmosis", "relayer", ('q', 'balance', 'akash'), f"address {{{OTHER_ACCOUNT}}} balance {{1uakt}}")
+            kujira = parse_balance(backend.query("kujira", "relayer", ('q', 'balance', 'akash')))
+            osmosis = parse_balance(backend.query("osmosis", "relayer", ('q', 'balance', 'akash')))
+        self.assertEqual(kujira["account"], ACCOUNT)
+        self.assertEqual(osmosis["account"], OTHER_ACCOUNT)
+        self.assertEqual(osmosis["balances"], [{"amount": 7, "denom": "uakt"}])
+
+    def test_reconnects_when_the_server_closed_an_idle_connection(self):
+        with StubServer(lcd, close_idle=True) as server:
+            backend = self.backend(server, {("kujira", "relayer", "akash"): ACCOUNT})
+            outputs = [backend.query("kujira", "relayer", ('q', 'balance', 'akash')) for _ in range(2)]
+        self.assertEqual(outputs[0], outputs[1])
+        # Two pages and a denom trace, then two pages again, each on a new connection
+        self.assertEqual(server.connections, 5)
+
+    def test_error_status_raises(self):
+        with StubServer(lambda method, path, body: (500, {})) as server:
+            backend = self.backend(server, {("kujira", "relayer", "akash"): ACCOUNT})
+            with self.assertRaises(HTTPError):
+                backend.query("kujira", "relayer", ('q', 'balance', 'akash'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+"""
+Format checks of the parsers against a corpus of rly outputs.
+
+Every sample in corpus/ is parsed and compared with corpus/expected.json, so
+a change in the output of rly, or in a parser, that alters what is read
+fails here. The samples are also mutated at random: a parser must either
+read a mutated sample or raise ParseError, never fail in another way.
+
+After an intended format change, add a sample and rewrite expected.json with:
+
+    python -m tests.test_parsers --update
+"""
+import json
+import os
+import random
+import sys
+import unittest
+
+from ibc_monitor.parsers import (ParseError, parse_balance, parse_chain_names, parse_client_expiration,
+                                 parse_discovered_paths, parse_expiring_clients, summarize_unrelayed_packets)
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+EXPECTED_FILE = os.path.join(CORPUS_DIR, "expected.json")
+FUZZ_ITERATIONS = 5000
+
+with open(os.path.join(CORPUS_DIR, "chains-list.json")) as f:
+    CHAIN_NAMES = parse_chain_names(f.read())
+
+
+def read_expirations(output: str) -> list:
+    return [[client_id, chain_id, expiration_date.isoformat()]
+            for client_id, chain_id, expiration_date in map(parse_client_expiration, parse_expiring_clients(output))]
+
+
+def read_unrelayed_packets(output: str) -> dict:
+    return {direction: {"present": summary.present, "count": summary.count, "min": summary.min,
+                        "max": summary.max, "ranges": summary.ranges}
+            for direction, summary in summarize_unrelayed_packets(output).items()}
+
+
+# The parser of each sample, picked by the start of its file name
+PARSERS = {
+    "balance": parse_balance,
+    "clients-expiration": read_expirations,
+    "unrelayed-packets": read_unrelayed_packets,
+    "chains-list": parse_chain_names,
+    "paths-list": lambda output: parse_discovered_paths("kujira", output, CHAIN_NAMES),
+}
+
+
+def sample_parser(name: str):
+    for prefix, parse in PARSERS.items():
+        if name.startswith(prefix):
+            return parse
+    raise LookupError(f"No parser for corpus sample {name}")
+
+
+def load_corpus() -> dict:
+    samples = {}
+    for name in sorted(os.listdir(CORPUS_DIR)):
+        if name != os.path.basename(EXPECTED_FILE):
+            with open(os.path.join(CORPUS_DIR, name)) as f:
+                samples[name] = f.read()
+    return samples
+
+
+def parse_corpus(samples: dict) -> dict:
+    results = {name: sample_parser(name)(output) for name, output in samples.items()}
+    # Round trip through JSON, so tuples and lists compare equal
+    return json.loads(json.dumps(results))
+
+
+def mutate(output: str, rng: random.Random) -> str:
+    """Damage an output the way a format change or a cut off stream would."""
+    start = rng.randrange(len(output) + 1)
+    end = rng.randrange(start, min(len(output), start + 16) + 1)
+    kind = rng.randrange(5)
+    if kind == 0:
+        return output[:start]
+    if kind == 1:
+        return output[:start] + output[end:]
+    if kind == 2:
+        junk = "".join(rng.choice('{}[](),:"- \n0123456789abcXYZ/') for _ in range(rng.randint(1, 8)))
+        return output[:start] + junk + output[end:]
+    if kind == 3:
+        return output[:start] + output[start:end] * 2 + output[end:]
+    return output.replace(rng.choice(["{", "}", "(", ")", ",", " ", "[", "]", '"']), "", rng.randint(1, 3))
+
+
+class CorpusTest(unittest.TestCase):
+
+    def test_samples_parse_as_expected(self):
+        with open(EXPECTED_FILE) as f:
+            expected = json.load(f)
+        results = parse_corpus(load_corpus())
+        for name, result in results.items():
+            with self.subTest(sample=name):
+                self.assertEqual(result, expected.get(name))
+        self.assertEqual(sorted(expected), sorted(results))
+
+    def test_damaged_samples_parse_or_raise_parse_error(self):
+        samples = load_corpus()
+        names = list(samples)
+        rng = random.Random(0)
+        failures = []
+        for _ in range(FUZZ_ITERATIONS):
+            name = rng.choice(names)
+            mutated = mutate(samples[name], rng)
+            try:
+                sample_parser(name)(mutated)
+            except ParseError:
+                pass
+            except Exception as e:
+                failures.append(f"{name}: {type(e).__name__}: {e} on {mutated[:120]!r}")
+        self.assertEqual(failures, [])
+
+
+class DiscoveryParserTest(unittest.TestCase):
+
+    def test_unexpected_json_shapes_raise_parse_error(self):
+        for output in ('{"kujira": []}', '{"kujira": {"value": []}}', '{"kujira": {"value": {"chain-id": 5}}}'):
+            with self.subTest(output=output), self.assertRaises(ParseError):
+                parse_chain_names(output)
+        for output in ('{"path": 1}', '{"path": {"src": "kaiyo-1"}}',
+                       '{"path": {"src-channel-filter": {"rule": "allowlist", "channel-list": "channel-1"}}}'):
+            with self.subTest(output=output), self.assertRaises(ParseError):
+                parse_discovered_paths("kujira", output, CHAIN_NAMES)
+
+    def test_missing_fields_are_empty(self):
+        self.assertEqual(parse_chain_names('{"kujira": {"value": {}}}'), {})
+        self.assertEqual(parse_discovered_paths("kujira", '{"path": {}}', CHAIN_NAMES), {})
+
+
+if __name__ == "__main__":
+    if "--update" in sys.argv:
+        with open(EXPECTED_FILE, "w") as f:
+            json.dump(parse_corpus(load_corpus()), f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Wrote the results of the corpus to {EXPECTED_FILE}")
+    else:
+        unittest.main()
@@ -0,0 +1,85 @@
+import os
+import stat
+import subprocess
+import tempfile
+import threading
+import unittest
+
+from ibc_monitor.queries import CircuitBreaker, batch_script, split_batch_output
+
+RLY = """#!/bin/sh
+case "$3" in
+  fail) echo "error: no such chain" >&2; exit 1 ;;
+  *) printf 'address {%s} balance {1u%s}\\n' "$3" "$3" ;;
+esac
+"""
+
+
+class BatchTest(unittest.TestCase):
+
+    def test_outputs_are_split_per_query(self):
+        output = ("noise\n--- rly-batch t 0 begin ---\nfirst\n--- rly-batch t 0 end 0 ---\n"
+                  "--- rly-batch t 1 begin ---\npartial\n--- rly-batch t 1 end 1 ---\n"
+                  "--- rly-batch t 3 begin ---\nstray\n--- rly-batch t 3 end 0 ---\n"
+                  "--- rly-batch other 2 begin ---\nforeign\n--- rly-batch other 2 end 0 ---\n")
+        # Failed, missing and out of range frames are left out
+        self.assertEqual(split_batch_output(output, "t", 3), ["first", None, None])
+
+    def test_script_runs_on_stdin(self):
+        queries = [('q', 'balance', name) for name in ("akash", "fail", "osmosis")] * 200
+        with tempfile.TemporaryDirectory() as directory:
+            rly = os.path.join(directory, "rly")
+            with open(rly, "w") as f:
+                f.write(RLY)
+            os.chmod(rly, stat.S_IRWXU)
+            result = subprocess.run(["sh", "-s"], input=batch_script(queries, "t", 8), capture_output=True,
+                                    text=True, env={**os.environ, "PATH": f"{directory}:{os.environ['PATH']}"})
+        outputs = split_batch_output(result.stdout, "t", len(queries))
+        self.assertEqual(outputs[:3], ["address {akash} balance {1uakash}", None, "address {osmosis} balance {1uosmosis}"])
+        self.assertEqual(outputs[-3:], outputs[:3])
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def opened(self) -> CircuitBreaker:
+        breaker = CircuitBreaker(("ns", "relayer"), 2, 0)
+        with self.assertLogs(level="ERROR"):
+            breaker.record_failure()
+            breaker.record_failure()
+        return breaker
+
+    def other_thread_allowed(self, breaker: CircuitBreaker) -> bool:
+        allowed = []
+        thread = threading.Thread(target=lambda: allowed.append(breaker.allow()))
+        thread.start()
+        thread.join()
+        return allowed[0]
+
+    def test_single_probe_after_the_reset_timeout(self):
+        breaker = self.opened()
+        self.assertTrue(breaker.allow())
+        self.assertTrue(breaker.probing())
+        self.assertFalse(self.other_thread_allowed(breaker))
+        # A failed probe keeps the breaker open until the next reset timeout
+        breaker.record_failure()
+        self.assertFalse(breaker.probing())
+        self.assertIsNotNone(breaker.opened_at)
+
+    def test_successful_probe_closes_the_breaker(self):
+        breaker = self.opened()
+        self.assertTrue(breaker.allow())
+        with self.assertLogs(level="INFO"):
+            breaker.record_success()
+        self.assertIsNone(breaker.opened_at)
+        self.assertFalse(breaker.probing())
+        self.assertTrue(self.other_thread_allowed(breaker))
+
+    def test_abandoned_probe_lets_another_thread_probe(self):
+        breaker = self.opened()
+        self.assertTrue(breaker.allow())
+        breaker.abandon_probe()
+        self.assertTrue(self.other_thread_allowed(breaker))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import copy
+import tempfile
+import unittest
+
+from ibc_monitor import runtime, settings
+from ibc_monitor.sharding import SHARD, FileLeaseBackend, HashRing
+
+KEYS = [f"kujira/path-{index}" for index in range(1000)]
+
+
+class FileLeaseBackendTest(unittest.TestCase):
+
+    def test_members_are_those_with_a_live_lease(self):
+        with tempfile.TemporaryDirectory() as directory:
+            backend = FileLeaseBackend(directory)
+            backend.renew("replica/a", 60)
+            backend.renew("replica-b", 60)
+            backend.renew("replica-c", -1)
+            self.assertEqual(sorted(backend.members()), ["replica-b", "replica/a"])
+            backend.release("replica/a")
+            backend.release("replica-d")
+            self.assertEqual(backend.members(), ["replica-b"])
+
+
+class HashRingTest(unittest.TestCase):
+
+    def owners(self, members: list) -> dict:
+        ring = HashRing(members, 64)
+        return {key: ring.owner(key) for key in KEYS}
+
+    def test_every_member_gets_a_share(self):
+        owners = self.owners(["a", "b", "c"])
+        shares = {member: list(owners.values()).count(member) for member in "abc"}
+        for member, share in shares.items():
+            self.assertGreater(share, 200, member)
+        self.assertIsNone(HashRing([], 64).owner("kujira/path-0"))
+
+    def test_membership_changes_only_move_the_share_of_that_member(self):
+        before = self.owners(["a", "b", "c"])
+        joined = self.owners(["a", "b", "c", "d"])
+        moved = [key for key in KEYS if before[key] != joined[key]]
+        self.assertTrue(moved)
+        self.assertTrue(all(joined[key] == "d" for key in moved))
+        left = self.owners(["a", "c"])
+        moved = [key for key in KEYS if before[key] != left[key]]
+        self.assertTrue(all(before[key] == "b" for key in moved))
+
+
+class ShardMembershipTest(unittest.TestCase):
+
+    def setUp(self):
+        self.config = settings.CONFIG
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        runtime.use_config(self.config)
+        self.directory.cleanup()
+
+    def sharded_config(self, member: str) -> dict:
+        config = copy.deepcopy(self.config)
+        config["sharding"].update(enabled=True, backend="file", lease_dir=self.directory.name, member_id=member)
+        return config
+
+    def test_reload_applies_the_sharding_settings(self):
+        runtime.use_config(self.sharded_config("a"))
+        self.assertTrue(SHARD.enabled)
+        self.assertEqual(SHARD.member, "a")
+        runtime.use_config(self.sharded_config("b"))
+        self.assertEqual(SHARD.member, "b")
+
+    def test_share_follows_the_membership(self):
+        runtime.use_config(self.sharded_config("a"))
+        SHARD.refresh()
+        self.assertTrue(all(SHARD.owns("kujira", f"path-{index}") for index in range(100)))
+        FileLeaseBackend(self.directory.name).renew("b", 60)
+        SHARD.refresh()
+        owned = [SHARD.owns("kujira", f"path-{index}") for index in range(100)]
+        self.assertIn(True, owned)
+        self.assertIn(False, owned)
+
+
+if __name__ == "__main__":
+    unittest.main()